@@ -0,0 +1,83 @@
+import time
+import argparse
+import psycopg2
+from etl import get_files, transform_song_file, load_song_file, transform_song_batch, load_song_batch
+
+
+def batches(all_files, batch_size):
+    """
+    - Splits the files into lists of batch_size files
+    """
+    return [all_files[i:i + batch_size] for i in range(0, len(all_files), batch_size)]
+
+
+def run_per_file(all_files, cur=None):
+    """
+    - Reads every file with the current per-file pandas path, inserting each one if a cursor is given
+    """
+    for datafile in all_files:
+        data = transform_song_file(datafile)
+        if cur is not None:
+            load_song_file(cur, data)
+
+
+def run_batched(all_files, batch_size, cur=None):
+    """
+    - Reads the files in batches with the JSON decoder, inserting each batch with one statement per table if a cursor is given
+    """
+    for batch in batches(all_files, batch_size):
+        columns = transform_song_batch(batch)
+        if cur is not None:
+            load_song_batch(cur, columns)
+
+
+def best_time(func, repeat, conn=None):
+    """
+    - Runs func repeat times and returns the fastest wall time in seconds
+    - When a connection is given every run is rolled back so that the tables are left unchanged
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+        if conn is not None:
+            conn.rollback()
+    return min(timings)
+
+
+def main():
+    """
+    - Micro-benchmark of the per-file song path against the batched JSON reader on the song_data tree
+    - Times reading and transforming the files only, and also inserting them when --dsn is given
+    - Prints the best time of --repeat runs for each path with the files/sec and the speedup of the batched reader
+    """
+    parser = argparse.ArgumentParser(description="Compare the per-file and batched song readers")
+    parser.add_argument("--data", default="data/song_data", help="directory holding the song JSON files")
+    parser.add_argument("--batch-size", type=int, default=100, help="number of files per batch for the batched reader")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs of each path, the fastest is reported")
+    parser.add_argument("--dsn", help="connection string of a database with the sparkify tables, to include the inserts")
+    args = parser.parse_args()
+
+    all_files = get_files(args.data)
+    print('{} song files found in {}'.format(len(all_files), args.data))
+
+    conn, cur = None, None
+    if args.dsn:
+        conn = psycopg2.connect(args.dsn)
+        cur = conn.cursor()
+
+    per_file = best_time(lambda: run_per_file(all_files, cur), args.repeat, conn)
+    batched = best_time(lambda: run_batched(all_files, args.batch_size, cur), args.repeat, conn)
+
+    print('{:<28}{:>10}{:>14}'.format('path', 'seconds', 'files/sec'))
+    print('{:<28}{:>10.3f}{:>14.0f}'.format('per file (pandas)', per_file, len(all_files) / per_file))
+    print('{:<28}{:>10.3f}{:>14.0f}'.format('batched ({} files)'.format(args.batch_size), batched, len(all_files) / batched))
+    print('speedup: {:.1f}x'.format(per_file / batched))
+
+    if conn is not None:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
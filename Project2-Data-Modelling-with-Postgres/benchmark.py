@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import argparse
+import resource
+import contextlib
+import multiprocessing
+from datetime import datetime
+import psycopg2
+import etl
+from create_tables import drop_tables, create_tables
+from generate_data import generate
+
+MODES = ["python", "bulk", "staging"]
+
+
+def peak_rss_kb():
+    """
+    - Returns the peak resident set size so far of this process and of its finished child processes (the --workers pool), in kilobytes
+    """
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def stages(mode, data, workers, batch_size):
+    """
+    - Returns the stages of an ETL run in the given mode as (stage name, function of cur and conn returning the rows written)
+    """
+    song_path = os.path.join(data, "song_data")
+    log_path = os.path.join(data, "log_data")
+
+    if mode == "staging":
+        return [("staging", lambda cur, conn: etl.process_data_staged(cur, conn, song_path, log_path, batch_size=batch_size))]
+
+    log_func = etl.process_log_file_bulk if mode == "bulk" else etl.process_log_file
+    return [
+        ("song_data", lambda cur, conn: etl.process_data(cur, conn, song_path, etl.process_song_file, workers=workers, batch_size=batch_size)),
+        ("log_data", lambda cur, conn: etl.process_data(cur, conn, log_path, log_func, workers=workers)),
+    ]
+
+
+def run_stage(dsn, scale, mode, stage, data, workers, batch_size, results):
+    """
+    - Runs one stage of an ETL run in the given mode, in a process of its own so that its peak RSS does not include the peak of the stages before it
+    - Puts a result with the wall time, rows, rows/sec and peak RSS of the stage on the results queue
+    """
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+
+    func = dict(stages(mode, data, workers, batch_size))[stage]
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        num_rows = func(cur, conn)
+    elapsed = time.perf_counter() - start
+    rss, child_rss = peak_rss_kb()
+    results.put({
+        "scale": scale,
+        "mode": mode,
+        "stage": stage,
+        "workers": workers,
+        "rows": num_rows,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(num_rows / elapsed, 1) if elapsed else None,
+        "peak_rss_kb": rss,
+        "peak_child_rss_kb": child_rss,
+    })
+
+    conn.close()
+
+
+def run_mode(dsn, scale, mode, data, workers, batch_size):
+    """
+    - Recreates the sparkify tables and loads the data folder in the given mode, running each stage in a child process with run_stage
+    - Returns the result of each stage
+    """
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    drop_tables(cur, conn)
+    create_tables(cur, conn)
+    conn.close()
+
+    stage_results = []
+    for stage, func in stages(mode, data, workers, batch_size):
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=run_stage, args=(dsn, scale, mode, stage, data, workers, batch_size, results))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise RuntimeError("benchmark run failed for scale {} in {} mode at the {} stage".format(scale, mode, stage))
+        stage_results.append(results.get())
+    return stage_results
+
+
+def main():
+    """
+    - Generates the synthetic data for each scale factor, unless it is already in --data-dir
+    - Loads each scale in each mode into the database given by --dsn, which is dropped and recreated for every run
+    - Prints the results and appends them, with the time of the run, to the JSON file given by --output so that runs can be compared
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the sparkify ETL on synthetic data")
+    parser.add_argument("--dsn", default="host=127.0.0.1 dbname=sparkifydb user=student password=student", help="connection string of the benchmark database, its tables are dropped")
+    parser.add_argument("--scale", type=int, nargs="+", default=[1, 10], help="scale factors to run, for example 1 10 100 1000")
+    parser.add_argument("--mode", nargs="+", choices=MODES, default=MODES, help="ETL modes to run")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes used to read the JSON files in the python and bulk modes")
+    parser.add_argument("--song-batch-size", type=int, default=100, help="number of song files read and inserted together")
+    parser.add_argument("--data-dir", default="generated_data", help="directory holding the scale_<n> data folders")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file the results are appended to")
+    args = parser.parse_args()
+
+    run = {"started_at": datetime.now().isoformat(timespec="seconds"), "results": []}
+    for scale in args.scale:
+        data = os.path.join(args.data_dir, "scale_{}".format(scale))
+        if not os.path.isdir(data):
+            num_songs, num_events = generate(data, scale)
+            print('{} song files and {} log events written to {}'.format(num_songs, num_events, data))
+
+        for mode in args.mode:
+            for result in run_mode(args.dsn, scale, mode, data, args.workers, args.song_batch_size):
+                run["results"].append(result)
+                print('scale {scale:>5} {mode:<8} {stage:<10} {rows:>10} rows {seconds:>9.3f}s {rows_per_sec:>10.0f} rows/sec '
+                      'peak rss {peak_rss_kb} KB'.format(**result))
+
+    history = []
+    if os.path.exists(args.output):
+        with open(args.output) as f:
+            history = json.load(f)
+    history.append(run)
+    with open(args.output, "w") as f:
+        json.dump(history, f, indent=2)
+    print('results written to {}'.format(args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import io
+import pandas as pd
+
+
+def format_copy_value(value):
+    """
+    - Formats a single value for the PostgreSQL COPY text format
+    - None, NaN and NaT values are written as the COPY null marker
+    - Backslashes, tabs and line breaks are escaped so that they are not read as delimiters
+    """
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return "\\N"
+    return (str(value)
+            .replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r"))
+
+
+def copy_rows(cur, table, columns, rows):
+    """
+    - Writes the rows to an in-memory buffer in the COPY text format
+    - Streams the buffer to the table with a single COPY ... FROM STDIN
+    - Returns the number of rows copied
+    """
+    buffer = io.StringIO()
+    num_rows = 0
+    for row in rows:
+        buffer.write("\t".join(format_copy_value(value) for value in row))
+        buffer.write("\n")
+        num_rows += 1
+
+    if num_rows == 0:
+        return 0
+
+    buffer.seek(0)
+    cur.copy_expert("COPY {} ({}) FROM STDIN".format(table, ", ".join(columns)), buffer)
+    return num_rows
+
+
+def merge_rows(cur, stage_create, stage_table, merge_query, columns, rows):
+    """
+    - Creates (if needed) the temporary stage table using the query in `stage_create`
+    - Copies the rows into the stage table
+    - Merges the stage table into the target table using the INSERT ... SELECT ... ON CONFLICT query in `merge_query`
+    - Empties the stage table so that it can be reused by the next batch
+    - Returns the number of rows copied
+    """
+    cur.execute(stage_create)
+    num_rows = copy_rows(cur, stage_table, columns, rows)
+    if num_rows:
+        cur.execute(merge_query)
+    cur.execute("TRUNCATE {}".format(stage_table))
+    return num_rows
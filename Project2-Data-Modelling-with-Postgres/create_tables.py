@@ -1,5 +1,7 @@
+import argparse
 import psycopg2
-from sql_queries import create_table_queries, drop_table_queries
+from sql_queries import create_table_queries, drop_table_queries, initial_load_create_table_queries, index_create_queries, \
+    primary_key_create_queries, primary_key_select, analyze_tables
 
 
 def create_database():
@@ -36,15 +38,41 @@ def drop_tables(cur, conn):
         conn.commit()
 
 
-def create_tables(cur, conn):
+def create_tables(cur, conn, initial_load=False):
     """
-    Creates each table using the queries in `create_table_queries` list. 
+    Creates each table using the queries in `create_table_queries` list, followed by the lookup indexes in `index_create_queries`.
+
+    In initial-load mode the tables are created without primary keys or indexes using the queries in `initial_load_create_table_queries`, and build_keys is run once the initial load is complete.
     """
-    for query in create_table_queries:
+    if initial_load:
+        for query in initial_load_create_table_queries:
+            cur.execute(query)
+            conn.commit()
+        return
+
+    for query in create_table_queries + index_create_queries:
         cur.execute(query)
         conn.commit()
 
 
+def build_keys(cur, conn):
+    """
+    - Adds the primary keys missing from tables created in initial-load mode
+    - Creates the lookup indexes if they do not already exist
+    - Runs ANALYZE so that the planner has statistics for the loaded tables
+    """
+    for table, query in primary_key_create_queries.items():
+        cur.execute(primary_key_select, (table,))
+        if cur.fetchone() is None:
+            cur.execute(query)
+
+    for query in index_create_queries:
+        cur.execute(query)
+
+    cur.execute(analyze_tables)
+    conn.commit()
+
+
 def main():
     """
     - Drops (if exists) and Creates the sparkify database. 
@@ -54,14 +82,18 @@ def main():
     
     - Drops all the tables.  
     
-    - Creates all tables needed. 
+    - Creates all tables needed.  With --initial-load the tables are created without keys or indexes for a faster initial load with `etl.py --initial-load`, which builds them once the data is loaded.
     
     - Finally, closes the connection. 
     """
+    parser = argparse.ArgumentParser(description="Create the sparkify database")
+    parser.add_argument("--initial-load", action="store_true", help="create the tables without keys or indexes for an initial load")
+    args = parser.parse_args()
+
     cur, conn = create_database()
     
     drop_tables(cur, conn)
-    create_tables(cur, conn)
+    create_tables(cur, conn, initial_load=args.initial_load)
 
     conn.close()
 
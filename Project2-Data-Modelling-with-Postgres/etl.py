@@ -1,97 +1,525 @@
 import os
 import glob
+import json
+import time
+import argparse
+import functools
+import multiprocessing
 import psycopg2
+from psycopg2.extras import execute_values
 import pandas as pd
 from sql_queries import *
+from bulk_load import copy_rows, merge_rows
+from song_lookup import SongLookup
+from manifest import changed_files, record_file, manifest_path
+from create_tables import build_keys
+from etl_metrics import Metrics, profiled
 
+# orjson is used to parse the song files when it is installed, otherwise the standard library decoder is used
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
-def process_song_file(cur, filepath):
+# song and artist lookup shared by every file processed in the run
+song_lookup = SongLookup()
+
+# stage timings and counters of the run, reported with --metrics-json and --metrics-prom
+metrics = Metrics()
+SONG = "process_song_file"
+LOG = "process_log_file"
+
+
+def transform_song_file(filepath):
     """
     - Reads in the JSON file as per the specified filepath
-    - Inserts a record with the required fields to the song and artist tables
+    - Returns the song and artist records with the required fields for the song and artist tables
     """
     # open song file
-    df = pd.read_json(filepath, lines=True)
+    with metrics.stage(SONG, "parse"):
+        df = pd.read_json(filepath, lines=True)
 
-    # insert song record
-    song_data = list(df[["song_id", "title", "artist_id", "year", "duration"]].values[0])
-    cur.execute(song_table_insert, song_data)
+    with metrics.stage(SONG, "transform"):
+        song_data = list(df[["song_id", "title", "artist_id", "year", "duration"]].values[0])
+        artist_data = list(df[["artist_id", "artist_name", "artist_location", "artist_latitude", "artist_longitude"]].values[0])
+
+    return song_data, artist_data
+
+
+def load_song_file(cur, data):
+    """
+    - Inserts the song and artist records returned by transform_song_file to the song and artist tables
+    - Adds the song and artist to the song lookup
+    - Returns the number of rows written
+    """
+    song_data, artist_data = data
+
+    with metrics.stage(SONG, "insert"):
+        # insert song record
+        cur.execute(song_table_insert, song_data)
     
-    # insert artist record
-    artist_data = list(df[["artist_id", "artist_name", "artist_location", "artist_latitude", "artist_longitude"]].values[0])
-    cur.execute(artist_table_insert, artist_data)
+        # insert artist record
+        cur.execute(artist_table_insert, artist_data)
 
+    song_id, title, artist_id, year, duration = song_data
+    song_lookup.add_song(song_id, title, artist_id, duration)
+    song_lookup.add_artist(*artist_data[:2])
 
-def process_log_file(cur, filepath):
+    return 2
+
+
+def process_song_file(cur, filepath):
+    """
+    - Reads in the JSON file as per the specified filepath
+    - Inserts a record with the required fields to the song and artist tables
+    - Returns the number of rows written
+    """
+    return load_song_file(cur, transform_song_file(filepath))
+
+
+def transform_song_batch(filepaths):
+    """
+    - Reads in each JSON file in filepaths, decoding every record without building a dataframe
+    - Returns the fields required for the song and artist tables as one list per column
+    """
+    with metrics.stage(SONG, "parse"):
+        records = []
+        for filepath in filepaths:
+            with open(filepath, 'rb') as f:
+                records.extend(json_loads(line) for line in f if line.strip())
+
+    with metrics.stage(SONG, "transform"):
+        columns = {field: [record.get(field) for record in records] for field in song_batch_fields}
+
+    return columns
+
+
+def load_song_batch(cur, columns):
+    """
+    - Inserts the songs and artists returned by transform_song_batch with one multi-row statement for each table
+    - Adds the songs and artists to the song lookup
+    - Returns the number of rows written
+    """
+    song_data = list(zip(*(columns[field] for field in song_batch_song_fields)))
+    artist_data = list(zip(*(columns[field] for field in song_batch_artist_fields)))
+
+    with metrics.stage(SONG, "insert"):
+        execute_values(cur, song_table_insert_batch, song_data, page_size=max(len(song_data), 1))
+        execute_values(cur, artist_table_insert_batch, artist_data, page_size=max(len(artist_data), 1))
+
+    for song_id, title, artist_id, year, duration in song_data:
+        song_lookup.add_song(song_id, title, artist_id, duration)
+    for artist_id, name, location, latitude, longitude in artist_data:
+        song_lookup.add_artist(artist_id, name)
+
+    return len(song_data) + len(artist_data)
+
+
+def transform_log_file(filepath):
     """
     - Reads in the JSON file as per the specified filepath
     - Filters dataframe for songs with "NextSong" action
     - Reformats data fields for time the time table
-    - Filters for the data required for the time, user and songplay tables and inserts records to each of these tables
+    - Returns the filtered log dataframe, with the manifest path of the file as its source_path, together with the time and user dataframes
     """
     # open log file
-    df = pd.read_json(filepath, lines=True)
+    with metrics.stage(LOG, "parse"):
+        df = pd.read_json(filepath, lines=True)
 
-    # filter by NextSong action
-    df = df[df["page"] == "NextSong"]
+    with metrics.stage(LOG, "transform"):
+        # filter by NextSong action
+        df = df[df["page"] == "NextSong"].assign(source_path=manifest_path(filepath))
 
-    # convert timestamp column to datetime
-    t = pd.to_datetime(df["ts"], unit="ms")
+        # convert timestamp column to datetime
+        t = pd.to_datetime(df["ts"], unit="ms")
     
-    # insert time data records
-    time_data = [t, t.dt.hour, t.dt.day, t.dt.weekofyear, t.dt.month, t.dt.year, t.dt.dayofweek]
-    column_labels = ["start_time", "hour", "day", "week", "month", "year", "weekday"]
-    time_df = pd.DataFrame(dict(zip(column_labels, time_data)))
+        # insert time data records
+        time_data = [t, t.dt.hour, t.dt.day, t.dt.weekofyear, t.dt.month, t.dt.year, t.dt.dayofweek]
+        column_labels = ["start_time", "hour", "day", "week", "month", "year", "weekday"]
+        time_df = pd.DataFrame(dict(zip(column_labels, time_data)))
 
-    for i, row in time_df.iterrows():
-        cur.execute(time_table_insert, list(row))
+        # load user table
+        user_df = df[["userId", "firstName", "lastName", "gender", "level"]]
 
-    # load user table
-    user_df = df[["userId", "firstName", "lastName", "gender", "level"]]
+    return df, time_df, user_df
 
-    # insert user records
-    for i, row in user_df.iterrows():
-        cur.execute(user_table_insert, row)
 
-    # insert songplay records
-    for index, row in df.iterrows():
-        
-        # get songid and artistid from song and artist tables
-        cur.execute(song_select, (row.song, row.artist, row.length))
-        results = cur.fetchone()
-        
-        if results:
-            songid, artistid = results
-        else:
-            songid, artistid = None, None
+def resolve_songs(cur, df):
+    """
+    - Gets the song_id and artist_id of every log record from the song lookup
+    - Counts the records that were and were not found in the lookup
+    """
+    with metrics.stage(LOG, "lookup"):
+        df = song_lookup.resolve(cur, df)
+
+    num_matched = int(df["song_id"].notna().sum())
+    metrics.count(LOG, "lookup_matches", num_matched)
+    metrics.count(LOG, "lookup_misses", len(df) - num_matched)
+    return df
+
+
+def load_log_file(cur, data):
+    """
+    - Filters the dataframes returned by transform_log_file for the data required for the time, user and songplay tables and inserts records to each of these tables one row at a time
+    - Returns the number of rows written
+    """
+    df, time_df, user_df = data
+
+    # get songid and artistid from the song lookup for all records at once
+    df = resolve_songs(cur, df)
+
+    with metrics.stage(LOG, "insert"):
+        for i, row in time_df.iterrows():
+            cur.execute(time_table_insert, list(row))
+
+        # insert user records
+        for i, row in user_df.iterrows():
+            cur.execute(user_table_insert, row)
+
+        # insert songplay records
+        for index, row in df.iterrows():
+            songplay_data = [row.ts, row.userId, row.level, row.song_id, row.artist_id, row.sessionId, row.location, row.userAgent, row.source_path]
+            cur.execute(songplay_table_insert, songplay_data)
+
+    return len(time_df) + len(user_df) + len(df)
+
+
+def process_log_file(cur, filepath):
+    """
+    - Reads in the JSON file as per the specified filepath and builds the time and user dataframes
+    - Inserts records to the time, user and songplay tables one row at a time
+    - Returns the number of rows written
+    """
+    return load_log_file(cur, transform_log_file(filepath))
 
-        # insert songplay record
-        songplay_data = [row.ts, row.userId, row.level, songid, artistid, row.sessionId, row.location, row.userAgent]
-        cur.execute(songplay_table_insert, songplay_data)
 
+def load_log_file_bulk(cur, data):
+    """
+    - Streams the time and user records into temporary stage tables with COPY and merges them with the ON CONFLICT rules in sql_queries.py
+    - Streams the songplay records straight into the songplays table with COPY
+    - Returns the number of rows written
+    """
+    df, time_df, user_df = data
+
+    with metrics.stage(LOG, "insert"):
+        num_rows = merge_rows(cur, time_stage_create, "time_stage", time_table_merge,
+                              time_columns, time_df.itertuples(index=False, name=None))
+        num_rows += merge_rows(cur, user_stage_create, "users_stage", user_table_merge,
+                               user_columns, user_df.itertuples(index=False, name=None))
+
+    # get songid and artistid from the song lookup for all records at once
+    df = resolve_songs(cur, df)
+    songplay_df = df[["ts", "userId", "level", "song_id", "artist_id", "sessionId", "location", "userAgent", "source_path"]]
+
+    with metrics.stage(LOG, "insert"):
+        num_rows += copy_rows(cur, "songplays", songplay_columns, songplay_df.itertuples(index=False, name=None))
 
-def process_data(cur, conn, filepath, func):
+    return num_rows
+
+
+def process_log_file_bulk(cur, filepath):
+    """
+    - Reads in the JSON file as per the specified filepath and builds the time and user dataframes
+    - Loads the records to the time, user and songplay tables with COPY
+    - Returns the number of rows written
+    """
+    return load_log_file_bulk(cur, transform_log_file(filepath))
+
+
+# transform and load steps of each process function, used to split the work between worker processes and the writer
+PIPELINES = {
+    process_song_file: (transform_song_file, load_song_file),
+    process_log_file: (transform_log_file, load_log_file),
+    process_log_file_bulk: (transform_log_file, load_log_file_bulk),
+}
+
+# name each process function reports its metrics under
+METRIC_NAMES = {
+    process_song_file: SONG,
+    process_log_file: LOG,
+    process_log_file_bulk: LOG,
+}
+
+# transform and load steps that handle a batch of files at once, used when process_data is given a batch_size
+BATCH_PIPELINES = {
+    process_song_file: (transform_song_batch, load_song_batch),
+}
+
+
+def get_files(filepath):
     """
     - Identifies all files required from the directory with the .json extension
-    - Iterates over the files and processes each file by calling the function specified (for sparkify ETL this will be process_song_file or process_log_file)
-    - Prints details of number of files found and progress on files processed while running
+    - Returns the absolute file paths sorted so that every run processes the files in the same order
     """
-    # get all files matching extension from directory
     all_files = []
     for root, dirs, files in os.walk(filepath):
         files = glob.glob(os.path.join(root,'*.json'))
         for f in files :
             all_files.append(os.path.abspath(f))
 
+    return sorted(all_files)
+
+
+def unit_name(unit):
+    """
+    - Returns the file a unit of work is named after in profiles, the first file when the unit is a batch
+    """
+    return unit[0] if isinstance(unit, list) else unit
+
+
+def try_transform(transform, unit, profile_dir=None, profile_every=1):
+    """
+    - Calls transform on the unit of work, profiling it if it is in the profile sample
+    - Returns the result and None, or None and a description of the error if the unit could not be transformed, so that one malformed file does not stop the run
+    - Also returns the metrics recorded by transform, as they are lost when it runs in a worker process
+    """
+    with metrics.redirect(Metrics()) as unit_metrics:
+        try:
+            with profiled(profile_dir, profile_every, unit_name(unit), "transform"):
+                return transform(unit), None, unit_metrics
+        except Exception as e:
+            return None, '{}: {}'.format(type(e).__name__, e), unit_metrics
+
+
+def transformed_files(units, transform, workers, profile_dir=None, profile_every=1):
+    """
+    - Yields each unit of work (a file, or a list of files when batching) with the result of calling try_transform on it
+    - With more than one worker the units are transformed by a process pool, and the results are still yielded in the order of units
+    """
+    transform = functools.partial(try_transform, transform, profile_dir=profile_dir, profile_every=profile_every)
+    if workers <= 1:
+        for unit in units:
+            yield unit, transform(unit)
+        return
+
+    chunksize = max(1, min(64, len(units) // (workers * 4)))
+    with multiprocessing.Pool(workers) as pool:
+        yield from zip(units, pool.imap(transform, units, chunksize))
+
+
+def load_files(cur, unit_files, data, error, load, reloaded_files=(), profile_dir=None, profile_every=1):
+    """
+    - Loads the transformed data of the files inside a savepoint and records the files in the manifest, profiling the load if the files are in the profile sample
+    - The songplays already loaded from files in reloaded_files are deleted first inside the same savepoint, so that a changed file replaces its songplays rather than adding to them
+    - If the data could not be transformed or loaded, rolls back to the savepoint so that the rest of the transaction can still be committed
+    - Returns the number of rows written and None, or 0 and a description of the error
+    """
+    if error is not None:
+        return 0, error
+
+    cur.execute("SAVEPOINT etl_file")
+    try:
+        replaced = [manifest_path(datafile) for datafile in unit_files if datafile in reloaded_files]
+        if replaced:
+            cur.execute(songplay_source_delete, (replaced,))
+        with profiled(profile_dir, profile_every, unit_files[0], "load"):
+            num_rows = load(cur, data)
+        for datafile in unit_files:
+            record_file(cur, datafile)
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT etl_file")
+        return 0, '{}: {}'.format(type(e).__name__, e)
+
+    cur.execute("RELEASE SAVEPOINT etl_file")
+    return num_rows, None
+
+
+def reject_file(datafile, error, reject_path):
+    """
+    - Reports a file that could not be loaded and appends it with the error to the reject list at reject_path
+    - Rejected files are not recorded in the manifest, so they are tried again by the next run
+    """
+    print('Rejected {}: {}'.format(datafile, error))
+    if reject_path:
+        with open(reject_path, 'a', encoding='utf8') as f:
+            f.write('{}\t{}\n'.format(datafile, error.replace('\n', ' ')))
+
+
+def process_data(cur, conn, filepath, func, workers=1, full_refresh=False, batch_size=1,
+                 commit_every_files=1, commit_every_rows=None, reject_path='rejected_files.txt',
+                 profile_dir=None, profile_every=100):
+    """
+    - Identifies all files required from the directory with the .json extension
+    - Unless full_refresh is set, skips the files already recorded in the manifest and loads the files that have changed again, see changed_files
+    - Iterates over the files and processes each file by calling the function specified (for sparkify ETL this will be process_song_file or process_log_file)
+    - With more than one worker, the files are read and transformed in parallel by a process pool while this connection writes the results one file at a time in the order the files were found
+    - With a batch_size above one, functions that have a batch pipeline (process_song_file) read and load batch_size files at a time
+    - Records each file in the manifest in the same transaction as its data
+    - Commits once commit_every_files files or (if set) commit_every_rows rows have been written since the last commit
+    - Loads each file (or batch) inside a savepoint.  A file that cannot be read or loaded is rolled back, added to the reject list at reject_path and skipped, and the rest of its transaction is still committed.  A batch that fails is loaded again one file at a time so that only the bad files are rejected
+    - Records the time spent in each stage in the run metrics, with counts of the files processed, files rejected and rows written
+    - If profile_dir is set, writes cProfile stats of the transform and load of one in profile_every files to profile_dir
+    - Prints details of number of files found and progress on files processed while running, including the rows/sec written so far
+    - Returns the number of rows written
+    """
+    name = METRIC_NAMES.get(func, func.__name__)
+    profile = dict(profile_dir=profile_dir, profile_every=profile_every)
+
+    # get all files matching extension from directory
+    all_files = get_files(filepath)
+
     # get total number of files found
     num_files = len(all_files)
     print('{} files found in {}'.format(num_files, filepath))
 
+    # keep only the files that are new or have changed since the last run
+    reloaded_files = set()
+    if not full_refresh:
+        all_files, reloaded_files = changed_files(cur, all_files)
+        conn.commit()
+        num_files = len(all_files)
+        print('{} new or changed files to process'.format(num_files))
+
     # iterate over files and process
-    for i, datafile in enumerate(all_files, 1):
-        func(cur, datafile)
+    if batch_size > 1 and func in BATCH_PIPELINES:
+        transform, load = BATCH_PIPELINES[func]
+        units = [all_files[i:i + batch_size] for i in range(0, num_files, batch_size)]
+    else:
+        # functions without a split pipeline are passed the file path unchanged
+        transform, load = PIPELINES.get(func, (str, func))
+        units = all_files
+
+    num_rows = 0
+    num_rejected = 0
+    i = 0
+    files_since_commit = 0
+    rows_since_commit = 0
+    start = time.perf_counter()
+    for unit, (data, error, unit_metrics) in transformed_files(units, transform, workers, **profile):
+        metrics.merge(unit_metrics)
+        unit_files = unit if isinstance(unit, list) else [unit]
+        unit_rows, error = load_files(cur, unit_files, data, error, load, reloaded_files, **profile)
+
+        if error is not None and isinstance(unit, list) and len(unit) > 1:
+            # load the batch again one file at a time so that only the bad files are rejected
+            unit_rows = 0
+            for datafile in unit:
+                data, file_error, unit_metrics = try_transform(transform, [datafile])
+                metrics.merge(unit_metrics)
+                file_rows, file_error = load_files(cur, [datafile], data, file_error, load, reloaded_files)
+                unit_rows += file_rows
+                if file_error is not None:
+                    reject_file(datafile, file_error, reject_path)
+                    num_rejected += 1
+        elif error is not None:
+            for datafile in unit_files:
+                reject_file(datafile, error, reject_path)
+                num_rejected += 1
+
+        num_rows += unit_rows
+        files_since_commit += len(unit_files)
+        rows_since_commit += unit_rows
+        if files_since_commit >= commit_every_files or (commit_every_rows and rows_since_commit >= commit_every_rows):
+            with metrics.stage(name, "commit"):
+                conn.commit()
+            files_since_commit = 0
+            rows_since_commit = 0
+
+        i += len(unit_files)
+        elapsed = time.perf_counter() - start
+        print('{}/{} files processed. {:.0f} rows/sec'.format(i, num_files, num_rows / elapsed))
+
+    with metrics.stage(name, "commit"):
+        conn.commit()
+    if num_rejected:
+        print('{} files rejected, see {}'.format(num_rejected, reject_path))
+
+    metrics.count(name, "files_processed", num_files - num_rejected)
+    metrics.count(name, "files_rejected", num_rejected)
+    metrics.count(name, "rows_written", num_rows)
+
+    elapsed = time.perf_counter() - start
+    print('{} rows written from {} in {:.2f}s ({:.0f} rows/sec)'.format(num_rows, filepath, elapsed, num_rows / elapsed if elapsed else 0))
+
+    return num_rows
+
+
+def json_lines(filepaths):
+    """
+    - Yields each non-empty line of the JSON files with the manifest path of its file as a row for copy_rows
+    """
+    for filepath in filepaths:
+        source_path = manifest_path(filepath)
+        with open(filepath, encoding='utf8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield (line, source_path)
+
+
+def stage_files(cur, filepath, table, full_refresh=False, batch_size=100):
+    """
+    - Identifies the JSON files in the directory that are not yet recorded in the manifest or have changed since they were loaded (or all files if full_refresh is set)
+    - Copies every line of the files into the staging table as it is, with the manifest path of its file, with one COPY for each batch_size files
+    - Returns the files that were staged so that they can be recorded in the manifest once the load is complete, and the set of those that had changed
+    """
+    all_files = get_files(filepath)
+    print('{} files found in {}'.format(len(all_files), filepath))
+
+    reloaded_files = set()
+    if not full_refresh:
+        all_files, reloaded_files = changed_files(cur, all_files)
+        print('{} new or changed files to process'.format(len(all_files)))
+
+    num_files = len(all_files)
+    num_rows = 0
+    start = time.perf_counter()
+    for i in range(0, num_files, batch_size):
+        batch = all_files[i:i + batch_size]
+        with metrics.stage("process_data_staged", "copy"):
+            num_rows += copy_rows(cur, table, ["payload", "source_path"], json_lines(batch))
+        elapsed = time.perf_counter() - start
+        print('{}/{} files staged. {:.0f} rows/sec'.format(i + len(batch), num_files, num_rows / elapsed))
+
+    return all_files, reloaded_files
+
+
+def process_data_staged(cur, conn, song_filepath, log_filepath, full_refresh=False, batch_size=100, insert_queries=staged_insert_queries):
+    """
+    - Staging engine for the sparkify ETL, used in place of process_data
+    - Copies the raw song and log JSON into the staging_songs and staging_events tables
+    - Builds the songs, artists, users, time and songplays tables from the staging tables with the set-based inserts in `insert_queries` (`staged_insert_queries` by default, `initial_load_insert_queries` also builds the lookup indexes before the songplays insert), so that all of the transformation and the song lookup run inside Postgres
+    - The songplays of log files that have changed since they were loaded are deleted before the inserts, so that they are replaced by the reloaded rows
+    - Records the staged files in the manifest and empties the staging tables, committing everything in one transaction
+    - Returns the number of rows written to the star schema tables
+    """
+    for query in staging_table_create_queries:
+        cur.execute(query)
+    cur.execute(staging_truncate)
+
+    # song files that have changed are staged again as well, their inserts keep the first record of each song and artist
+    staged_files = stage_files(cur, song_filepath, "staging_songs", full_refresh, batch_size)[0]
+    log_files, reloaded_log_files = stage_files(cur, log_filepath, "staging_events", full_refresh, batch_size)
+    staged_files += log_files
+    if reloaded_log_files:
+        cur.execute(songplay_source_delete, ([manifest_path(datafile) for datafile in reloaded_log_files],))
+        print('{} songplays of {} changed files deleted'.format(cur.rowcount, len(reloaded_log_files)))
+
+    num_rows = 0
+    for query in insert_queries:
+        start = time.perf_counter()
+        with metrics.stage("process_data_staged", "insert"):
+            cur.execute(query)
+        elapsed = time.perf_counter() - start
+        if query.split()[0] != 'INSERT':
+            # statements such as the index builds of the initial load do not write rows
+            print('{} in {:.2f}s'.format(' '.join(query.split()[:6]), elapsed))
+            continue
+        num_rows += cur.rowcount
+        print('{} rows written to {} in {:.2f}s'.format(cur.rowcount, query.split()[2], elapsed))
+
+    for datafile in staged_files:
+        record_file(cur, datafile)
+
+    cur.execute(staging_truncate)
+    with metrics.stage("process_data_staged", "commit"):
         conn.commit()
-        print('{}/{} files processed.'.format(i, num_files))
+
+    metrics.count("process_data_staged", "files_processed", len(staged_files))
+    metrics.count("process_data_staged", "rows_written", num_rows)
+
+    return num_rows
 
 
 def main():
@@ -100,16 +528,67 @@ def main():
     - Establishes connection to PostgreSQL database sparkifydb
     - Gets cursor for PostgreSQL session
     - Calls process_data for the 'data/song_data' and 'data/log_data' directories
+    - Uses the COPY based loader for the log files when run with --bulk
+    - Reads the files with a pool of --workers processes when more than one worker is requested.  All song files are loaded before any log file is read, so the song lookup is complete for the songplays
+    - Reads and inserts the song files in batches of --song-batch-size files
+    - Loads the data with the staging engine in process_data_staged instead of process_data when run with --engine staging
+    - Loads tables created with `create_tables.py --initial-load` when run with --initial-load, using the staging engine without ON CONFLICT clauses and then building the primary keys and lookup indexes.  --initial-load always uses the staging engine, so it cannot be combined with --bulk, --workers or --engine
+    - Commits after every --commit-every-files files or --commit-every-rows rows, and writes files that cannot be loaded to the --reject-file list
+    - Writes the stage timings and counters of the run as a JSON summary to --metrics-json and in the Prometheus text format to --metrics-prom, and cProfile stats for a sample of files to --profile-dir
+    - Only loads the files that are new or have changed since the last run, replacing the songplays of changed files, unless run with --full-refresh which empties the tables and loads every file again
     - Closes connection
     """
+    parser = argparse.ArgumentParser(description="Sparkify ETL")
+    parser.add_argument("--bulk", action="store_true", help="load log files with COPY instead of row by row inserts")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes used to read and transform the JSON files")
+    parser.add_argument("--full-refresh", action="store_true", help="empty the tables and load every file, ignoring the manifest")
+    parser.add_argument("--song-batch-size", type=int, default=100, help="number of song files read and inserted together, 1 loads one file at a time")
+    parser.add_argument("--engine", choices=["python", "staging"], help="transform the data in python row by row (the default), or in Postgres from staging tables")
+    parser.add_argument("--initial-load", action="store_true", help="initial load into tables created with create_tables.py --initial-load, building their keys afterwards")
+    parser.add_argument("--commit-every-files", type=int, default=1, help="number of files loaded in each transaction")
+    parser.add_argument("--commit-every-rows", type=int, default=None, help="also commit once this many rows have been written since the last commit")
+    parser.add_argument("--reject-file", default="rejected_files.txt", help="file that the paths of files that could not be loaded are appended to")
+    parser.add_argument("--metrics-json", help="file to write the JSON summary of the stage timings and counters to")
+    parser.add_argument("--metrics-prom", help="file to write the stage timings and counters to in the Prometheus text format")
+    parser.add_argument("--profile-dir", help="directory to write cProfile stats of a sample of the files to")
+    parser.add_argument("--profile-every", type=int, default=100, help="profile one in this many files when --profile-dir is set")
+    args = parser.parse_args()
+    if args.initial_load and (args.bulk or args.workers != 1 or args.engine):
+        parser.error("--initial-load always uses the staging engine and cannot be combined with --bulk, --workers or --engine")
+
     conn = psycopg2.connect("host=127.0.0.1 dbname=sparkifydb user=student password=student")
     cur = conn.cursor()
 
-    process_data(cur, conn, filepath='data/song_data', func=process_song_file)
-    process_data(cur, conn, filepath='data/log_data', func=process_log_file)
+    # create the manifest and the source_path columns for databases created before they were added to create_tables.py
+    cur.execute(manifest_table_create)
+    for query in source_path_column_add_queries:
+        cur.execute(query)
+    if args.full_refresh:
+        cur.execute(full_refresh_truncate)
+    conn.commit()
+
+    if args.initial_load:
+        process_data_staged(cur, conn, song_filepath='data/song_data', log_filepath='data/log_data',
+                            full_refresh=args.full_refresh, batch_size=args.song_batch_size, insert_queries=initial_load_insert_queries)
+        build_keys(cur, conn)
+    elif args.engine == "staging":
+        process_data_staged(cur, conn, song_filepath='data/song_data', log_filepath='data/log_data',
+                            full_refresh=args.full_refresh, batch_size=args.song_batch_size)
+    else:
+        commit_options = dict(commit_every_files=args.commit_every_files, commit_every_rows=args.commit_every_rows, reject_path=args.reject_file,
+                              profile_dir=args.profile_dir, profile_every=args.profile_every)
+        process_data(cur, conn, filepath='data/song_data', func=process_song_file,
+                     workers=args.workers, full_refresh=args.full_refresh, batch_size=args.song_batch_size, **commit_options)
+        process_data(cur, conn, filepath='data/log_data', func=process_log_file_bulk if args.bulk else process_log_file,
+                     workers=args.workers, full_refresh=args.full_refresh, **commit_options)
 
     conn.close()
 
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json)
+    if args.metrics_prom:
+        metrics.write_prometheus(args.metrics_prom)
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import zlib
+import cProfile
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class Metrics:
+    """
+    Timings and counters for each stage of each ETL function.
+
+    - stage times a block of code as one call of a stage (parse, transform, lookup, insert or commit) of a function
+    - count adds to a named counter of a function
+    - redirect sends the measurements to another Metrics object for the duration of a block, which is how the work done by a worker process is collected and sent back with its result
+    """
+
+    def __init__(self):
+        self.started_at = datetime.now()
+        self.seconds = {}
+        self.calls = {}
+        self.counters = {}
+        self._target = self
+
+    @contextmanager
+    def stage(self, function, stage):
+        target = self._target
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            key = (function, stage)
+            target.seconds[key] = target.seconds.get(key, 0.0) + time.perf_counter() - start
+            target.calls[key] = target.calls.get(key, 0) + 1
+
+    def count(self, function, name, value=1):
+        key = (function, name)
+        self._target.counters[key] = self._target.counters.get(key, 0) + value
+
+    @contextmanager
+    def redirect(self, other):
+        previous, self._target = self._target, other
+        try:
+            yield other
+        finally:
+            self._target = previous
+
+    def merge(self, other):
+        """
+        - Adds the timings and counters of another Metrics object, such as one returned by a worker process
+        """
+        for key, seconds in other.seconds.items():
+            self.seconds[key] = self.seconds.get(key, 0.0) + seconds
+        for key, calls in other.calls.items():
+            self.calls[key] = self.calls.get(key, 0) + calls
+        for key, value in other.counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def summary(self):
+        """
+        - Returns the run summary as a dictionary with the stages and counters of each function
+        """
+        functions = {}
+        for (function, stage), seconds in sorted(self.seconds.items()):
+            stages = functions.setdefault(function, {"stages": {}, "counters": {}})["stages"]
+            stages[stage] = {"seconds": round(seconds, 6), "calls": self.calls[(function, stage)]}
+        for (function, name), value in sorted(self.counters.items()):
+            functions.setdefault(function, {"stages": {}, "counters": {}})["counters"][name] = value
+
+        return {
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "elapsed_seconds": round((datetime.now() - self.started_at).total_seconds(), 3),
+            "functions": functions,
+        }
+
+    def to_prometheus(self):
+        """
+        - Returns the timings and counters in the Prometheus text exposition format
+        """
+        lines = [
+            "# HELP sparkify_etl_stage_seconds_total Time spent in each stage of each ETL function.",
+            "# TYPE sparkify_etl_stage_seconds_total counter",
+        ]
+        for (function, stage), seconds in sorted(self.seconds.items()):
+            lines.append('sparkify_etl_stage_seconds_total{{function="{}",stage="{}"}} {}'.format(function, stage, seconds))
+
+        lines += [
+            "# HELP sparkify_etl_stage_calls_total Number of times each stage of each ETL function was run.",
+            "# TYPE sparkify_etl_stage_calls_total counter",
+        ]
+        for (function, stage), calls in sorted(self.calls.items()):
+            lines.append('sparkify_etl_stage_calls_total{{function="{}",stage="{}"}} {}'.format(function, stage, calls))
+
+        names = sorted({name for function, name in self.counters})
+        for name in names:
+            lines += [
+                "# HELP sparkify_etl_{}_total Number of {} counted by each ETL function.".format(name, name.replace("_", " ")),
+                "# TYPE sparkify_etl_{}_total counter".format(name),
+            ]
+            for (function, counter), value in sorted(self.counters.items()):
+                if counter == name:
+                    lines.append('sparkify_etl_{}_total{{function="{}"}} {}'.format(name, function, value))
+
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def write_prometheus(self, path):
+        with open(path, "w") as f:
+            f.write(self.to_prometheus())
+
+
+@contextmanager
+def profiled(profile_dir, profile_every, name, step):
+    """
+    - Runs the block under cProfile for a sample of one in profile_every files and writes the stats to profile_dir as <file name>.<step>.prof
+    - The sample is chosen from a checksum of the file name, so that worker processes and the writer pick the same files
+    - Runs the block as normal when no profile_dir is given
+    """
+    if not profile_dir or zlib.crc32(name.encode("utf8")) % profile_every:
+        yield
+        return
+
+    os.makedirs(profile_dir, exist_ok=True)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(os.path.join(profile_dir, "{}.{}.prof".format(os.path.basename(name), step)))
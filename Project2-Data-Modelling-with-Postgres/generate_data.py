@@ -0,0 +1,186 @@
+import os
+import json
+import random
+import string
+import argparse
+from datetime import datetime, timedelta
+
+# size of the generated data at scale factor 1, which is close to the bundled data folder
+SONGS_PER_SCALE = 100
+ARTISTS_PER_SCALE = 90
+USERS_PER_SCALE = 100
+EVENTS_PER_DAY_PER_SCALE = 270
+
+# share of NextSong events that play a song from the generated song files, so that the songplays lookup finds a match
+MATCH_RATE = 0.6
+
+START_DATE = datetime(2018, 11, 1)
+NUM_DAYS = 30
+
+PAGES = ["NextSong"] * 16 + ["Home", "Logout", "Settings", "Help"]
+LEVELS = ["free", "paid"]
+LOCATIONS = ["San Francisco-Oakland-Hayward, CA", "New York-Newark-Jersey City, NY-NJ-PA", "Atlanta-Sandy Springs-Roswell, GA",
+             "Chicago-Naperville-Elgin, IL-IN-WI", "Lansing-East Lansing, MI", "Portland-South Portland, ME"]
+USER_AGENTS = ["\"Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/36.0.1985.143 Safari/537.36\"",
+               "\"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_4) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/36.0.1985.143 Safari/537.36\"",
+               "Mozilla/5.0 (Windows NT 6.1; WOW64; rv:31.0) Gecko/20100101 Firefox/31.0"]
+WORDS = ["love", "night", "blue", "heart", "river", "dream", "fire", "city", "road", "light", "rain", "gold", "song", "home", "wild"]
+
+
+def random_id(rng, prefix, length=16):
+    """
+    - Returns an identifier in the style of the song and artist ids in the song files
+    """
+    return prefix + "".join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(length))
+
+
+def random_title(rng):
+    """
+    - Returns a song title or artist name made of two to four words
+    """
+    return " ".join(rng.choice(WORDS).capitalize() for _ in range(rng.randint(2, 4)))
+
+
+def generate_artists(rng, num_artists):
+    """
+    - Returns the artist fields of the song files for num_artists artists
+    """
+    artists = []
+    for i in range(num_artists):
+        has_location = rng.random() < 0.5
+        artists.append({
+            "artist_id": random_id(rng, "AR"),
+            "artist_name": "{} {}".format(random_title(rng), i),
+            "artist_location": rng.choice(LOCATIONS) if has_location else "",
+            "artist_latitude": round(rng.uniform(-60, 60), 5) if has_location else None,
+            "artist_longitude": round(rng.uniform(-150, 150), 5) if has_location else None,
+        })
+    return artists
+
+
+def generate_songs(rng, artists, num_songs):
+    """
+    - Returns song records with the same fields as the bundled song files, each by one of the artists
+    """
+    songs = []
+    for i in range(num_songs):
+        song = {"num_songs": 1}
+        song.update(rng.choice(artists))
+        song.update({
+            "song_id": random_id(rng, "SO"),
+            "title": "{} {}".format(random_title(rng), i),
+            "duration": round(rng.uniform(60, 600), 5),
+            "year": rng.choice([0, rng.randint(1960, 2010)]),
+        })
+        songs.append(song)
+    return songs
+
+
+def generate_users(rng, num_users):
+    """
+    - Returns the user fields of the log files for num_users users
+    """
+    return [{
+        "userId": str(i),
+        "firstName": random_title(rng).split()[0],
+        "lastName": random_title(rng).split()[0],
+        "gender": rng.choice(["M", "F"]),
+        "level": rng.choice(LEVELS),
+        "location": rng.choice(LOCATIONS),
+        "userAgent": rng.choice(USER_AGENTS),
+        "registration": float(rng.randint(1530000000000, 1540000000000)),
+    } for i in range(1, num_users + 1)]
+
+
+def generate_day(rng, day, songs, users, num_events, session_start):
+    """
+    - Returns num_events log events for the day in time order, grouped into user sessions
+    - A share of MATCH_RATE of the NextSong events play one of the generated songs, the rest play songs that are not in the song files
+    - Users sometimes change level, so that the users upsert has changes to apply
+    """
+    day_start = int((START_DATE + timedelta(days=day) - datetime(1970, 1, 1)).total_seconds() * 1000)
+    events = []
+    session_id = session_start
+    ts = day_start
+    while len(events) < num_events:
+        user = rng.choice(users)
+        if rng.random() < 0.05:
+            user["level"] = rng.choice(LEVELS)
+        session_id += 1
+        for item in range(min(rng.randint(1, 40), num_events - len(events))):
+            ts += rng.randint(1, max(2, 2 * 86400000 // num_events))
+            page = rng.choice(PAGES)
+            event = {"artist": None, "auth": "Logged In", "firstName": user["firstName"], "gender": user["gender"],
+                     "itemInSession": item, "lastName": user["lastName"], "length": None, "level": user["level"],
+                     "location": user["location"], "method": "PUT" if page == "NextSong" else "GET", "page": page,
+                     "registration": user["registration"], "sessionId": session_id, "song": None, "status": 200,
+                     "ts": ts, "userAgent": user["userAgent"], "userId": user["userId"]}
+            if page == "NextSong":
+                if rng.random() < MATCH_RATE:
+                    song = rng.choice(songs)
+                    event.update({"artist": song["artist_name"], "song": song["title"], "length": song["duration"]})
+                else:
+                    event.update({"artist": random_title(rng), "song": random_title(rng), "length": round(rng.uniform(60, 600), 5)})
+            events.append(event)
+    return events, session_id
+
+
+def song_path(output, song):
+    """
+    - Returns the path of a song file, nested by the third to fifth characters of its track id as in the bundled data
+    """
+    track_id = "TR" + song["song_id"][2:]
+    return os.path.join(output, "song_data", track_id[2], track_id[3], track_id[4], track_id + ".json")
+
+
+def generate(output, scale, seed=0):
+    """
+    - Writes song and log files with the same JSON schema as the bundled data folder to the output directory
+    - The number of songs, artists, users and events is scaled by the scale factor, with 30 days of November 2018 log files
+    - Returns the number of song files and log events written
+    """
+    rng = random.Random(seed)
+    artists = generate_artists(rng, ARTISTS_PER_SCALE * scale)
+    songs = generate_songs(rng, artists, SONGS_PER_SCALE * scale)
+    users = generate_users(rng, USERS_PER_SCALE * scale)
+
+    for song in songs:
+        path = song_path(output, song)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(song, f)
+
+    num_events = 0
+    session_id = 0
+    for day in range(NUM_DAYS):
+        events, session_id = generate_day(rng, day, songs, users, EVENTS_PER_DAY_PER_SCALE * scale, session_id)
+        date = START_DATE + timedelta(days=day)
+        path = os.path.join(output, "log_data", date.strftime("%Y"), date.strftime("%m"), date.strftime("%Y-%m-%d-events.json"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            for event in events:
+                f.write(json.dumps(event, separators=(",", ":")))
+                f.write("\n")
+        num_events += len(events)
+
+    return len(songs), num_events
+
+
+def main():
+    """
+    - Generates a synthetic sparkify data folder for each of the requested scale factors
+    """
+    parser = argparse.ArgumentParser(description="Generate synthetic sparkify song and log data")
+    parser.add_argument("--scale", type=int, nargs="+", default=[1], help="scale factors to generate, for example 1 10 100 1000")
+    parser.add_argument("--output", default="generated_data", help="directory the scale_<n> data folders are written to")
+    parser.add_argument("--seed", type=int, default=0, help="random seed, the same seed always writes the same files")
+    args = parser.parse_args()
+
+    for scale in args.scale:
+        output = os.path.join(args.output, "scale_{}".format(scale))
+        num_songs, num_events = generate(output, scale, args.seed)
+        print('{} song files and {} log events written to {}'.format(num_songs, num_events, output))
+
+
+if __name__ == "__main__":
+    main()
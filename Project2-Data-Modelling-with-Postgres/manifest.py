@@ -0,0 +1,65 @@
+import os
+import hashlib
+from sql_queries import manifest_select, manifest_table_insert
+
+
+def manifest_path(filepath):
+    """
+    - Returns the path stored in the manifest for a data file, relative to the working directory that etl.py is run from
+    """
+    return os.path.relpath(filepath)
+
+
+def file_hash(filepath):
+    """
+    - Returns the sha256 hash of the contents of the file
+    """
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def record_file(cur, filepath, content_hash=None):
+    """
+    - Inserts or updates the manifest record for the file with its current size, mtime and content hash
+    """
+    stat = os.stat(filepath)
+    if content_hash is None:
+        content_hash = file_hash(filepath)
+    cur.execute(manifest_table_insert, (manifest_path(filepath), stat.st_size, stat.st_mtime, content_hash))
+
+
+def changed_files(cur, all_files):
+    """
+    - Compares the files found against the manifest and returns the files that have not been loaded yet or have changed since they were loaded, in the order they were found, together with the set of the changed ones
+    - Files with the same size and mtime as in the manifest are skipped without being read
+    - Files with a new size or mtime but the same content hash have their manifest record updated
+    - Files whose contents have changed are loaded again.  etl.py deletes the songplays loaded from them, found by their source_path, in the same savepoint or transaction as the reload, and the song, artist, user and time inserts can be run again
+    """
+    cur.execute(manifest_select)
+    manifest = {path: (size, mtime, content_hash) for path, size, mtime, content_hash in cur.fetchall()}
+
+    new_files = []
+    reloaded_files = set()
+    for datafile in all_files:
+        entry = manifest.get(manifest_path(datafile))
+        if entry is None:
+            new_files.append(datafile)
+            continue
+
+        size, mtime, content_hash = entry
+        stat = os.stat(datafile)
+        if (stat.st_size, stat.st_mtime) == (size, mtime):
+            continue
+
+        current_hash = file_hash(datafile)
+        if current_hash == content_hash:
+            record_file(cur, datafile, current_hash)
+        else:
+            print('{} has changed since it was loaded and is loaded again'.format(datafile))
+            new_files.append(datafile)
+            reloaded_files.add(datafile)
+
+    return new_files, reloaded_files
@@ -0,0 +1,102 @@
+from decimal import Decimal
+import pandas as pd
+from sql_queries import song_lookup_select, artist_lookup_select
+
+
+def duration_key(value):
+    """
+    - Converts a song duration to the key used to match songs in the lookup
+    - Floats are converted through their shortest repr, which is the literal psycopg2 sends to Postgres, so that the match is the same as the numeric comparison in song_select
+    - Returns None for missing durations so that they never match, as NULL never matches in SQL
+    """
+    if value is None or pd.isna(value):
+        return None
+    if not isinstance(value, Decimal):
+        value = Decimal(repr(float(value)))
+    return str(value.normalize())
+
+
+class SongLookup:
+    """
+    In-memory index of the songs and artists tables keyed on (title, artist name, duration).
+
+    - The index is loaded from the database the first time it is used
+    - process_song_file adds the songs and artists it inserts so that the index stays in line with the tables
+    - resolve gets the song_id and artist_id for a whole dataframe of log records with a single pandas merge
+    """
+    key_columns = ["song", "artist", "length_key"]
+
+    def __init__(self):
+        self.songs = None
+        self.artists = None
+        self._frame = None
+
+    @property
+    def loaded(self):
+        return self.songs is not None
+
+    def load(self, cur):
+        """
+        - Reads the songs and artists tables into the index unless they have already been read
+        """
+        if self.loaded:
+            return
+
+        cur.execute(song_lookup_select)
+        self.songs = {song_id: (title, artist_id, duration_key(duration))
+                      for song_id, title, artist_id, duration in cur.fetchall()}
+
+        cur.execute(artist_lookup_select)
+        self.artists = {artist_id: name for artist_id, name in cur.fetchall()}
+
+        self._frame = None
+
+    def add_song(self, song_id, title, artist_id, duration):
+        """
+        - Adds a song to the index, keeping the existing record on conflict as song_table_insert does
+        - Songs added before the index is loaded are picked up when it is read from the database
+        """
+        if self.loaded and song_id not in self.songs:
+            self.songs[song_id] = (title, artist_id, duration_key(duration))
+            self._frame = None
+
+    def add_artist(self, artist_id, name):
+        """
+        - Adds an artist to the index, keeping the existing record on conflict as artist_table_insert does
+        """
+        if self.loaded and artist_id not in self.artists:
+            self.artists[artist_id] = name
+            self._frame = None
+
+    def frame(self):
+        """
+        - Returns the index as a dataframe of the key columns with song_id and artist_id, joining songs to artists as song_select does
+        - Only the first song is kept for each key, as song_select only fetches one row
+        """
+        if self._frame is None:
+            records = [(title, self.artists[artist_id], key, song_id, artist_id)
+                       for song_id, (title, artist_id, key) in self.songs.items()
+                       if artist_id in self.artists and key is not None]
+            self._frame = pd.DataFrame(records, columns=self.key_columns + ["song_id", "artist_id"]) \
+                .drop_duplicates(subset=self.key_columns)
+        return self._frame
+
+    def resolve(self, cur, df):
+        """
+        - Loads the index if needed
+        - Adds song_id and artist_id columns to the log dataframe, with None where the song is not found
+        - Returns the dataframe with the rows in their original order
+        """
+        self.load(cur)
+
+        keys = pd.DataFrame({
+            "song": df["song"].values,
+            "artist": df["artist"].values,
+            "length_key": [duration_key(length) for length in df["length"].values],
+        })
+        matches = keys.merge(self.frame(), how="left", on=self.key_columns)
+
+        df = df.copy()
+        df["song_id"] = matches["song_id"].astype(object).where(matches["song_id"].notna(), None).values
+        df["artist_id"] = matches["artist_id"].astype(object).where(matches["artist_id"].notna(), None).values
+        return df
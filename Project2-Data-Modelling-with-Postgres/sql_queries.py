@@ -5,11 +5,14 @@ user_table_drop = "DROP TABLE IF EXISTS users"
 song_table_drop = "DROP TABLE IF EXISTS songs"
 artist_table_drop = "DROP TABLE IF EXISTS artists"
 time_table_drop = "DROP TABLE IF EXISTS time"
+manifest_table_drop = "DROP TABLE IF EXISTS etl_manifest"
+staging_events_table_drop = "DROP TABLE IF EXISTS staging_events"
+staging_songs_table_drop = "DROP TABLE IF EXISTS staging_songs"
 
 # CREATE TABLES
 
 songplay_table_create = """CREATE TABLE IF NOT EXISTS songplays \
-(songplay_id serial PRIMARY KEY, start_time bigint NOT NULL, user_id int NOT NULL, level varchar, song_id varchar, artist_id varchar, session_id int, location varchar, user_agent varchar)"""
+(songplay_id serial PRIMARY KEY, start_time bigint NOT NULL, user_id int NOT NULL, level varchar, song_id varchar, artist_id varchar, session_id int, location varchar, user_agent varchar, source_path varchar)"""
 
 user_table_create = """CREATE TABLE IF NOT EXISTS users \
 (user_id int PRIMARY KEY, first_name varchar NOT NULL, last_name varchar NOT NULL, gender varchar, level varchar NOT NULL)"""
@@ -23,11 +26,47 @@ artist_table_create = """CREATE TABLE IF NOT EXISTS artists \
 time_table_create = """CREATE TABLE IF NOT EXISTS time \
 (start_time timestamp PRIMARY KEY, hour int, day int, week int, month int, year int, weekday int)"""
 
+# KEYS AND INDEXES
+
+# Primary keys added after an initial load when the tables have been created in initial-load mode by create_tables.py
+songplay_pkey_create = "ALTER TABLE songplays ADD PRIMARY KEY (songplay_id)"
+user_pkey_create = "ALTER TABLE users ADD PRIMARY KEY (user_id)"
+song_pkey_create = "ALTER TABLE songs ADD PRIMARY KEY (song_id)"
+artist_pkey_create = "ALTER TABLE artists ADD PRIMARY KEY (artist_id)"
+time_pkey_create = "ALTER TABLE time ADD PRIMARY KEY (start_time)"
+
+primary_key_select = "SELECT 1 FROM pg_index WHERE indrelid = %s::regclass AND indisprimary"
+
+# Lookup indexes for the columns that song_select and the staged songplays insert filter on.  The songs index covers title and duration together, and artists are found by name
+song_lookup_index_create = "CREATE INDEX IF NOT EXISTS songs_title_duration_idx ON songs (title, duration)"
+artist_name_index_create = "CREATE INDEX IF NOT EXISTS artists_name_idx ON artists (name)"
+
+analyze_tables = "ANALYZE songplays, users, songs, artists, time"
+
+song_lookup_analyze = "ANALYZE songs, artists"
+
+# The manifest records each data file that has been loaded so that etl.py only processes new files
+manifest_table_create = """CREATE TABLE IF NOT EXISTS etl_manifest \
+(path varchar PRIMARY KEY, size bigint NOT NULL, mtime double precision NOT NULL, content_hash varchar NOT NULL, loaded_at timestamp NOT NULL DEFAULT now())"""
+
+# Staging tables for the staging engine of etl.py.  Each line of the JSON files is copied in as it is and load_order keeps the order the lines were read in.  The tables are UNLOGGED as their contents are only needed for the duration of a load
+staging_events_table_create = """CREATE UNLOGGED TABLE IF NOT EXISTS staging_events \
+(load_order bigserial, payload jsonb NOT NULL, source_path varchar)"""
+
+staging_songs_table_create = """CREATE UNLOGGED TABLE IF NOT EXISTS staging_songs \
+(load_order bigserial, payload jsonb NOT NULL, source_path varchar)"""
+
+# songplays and the staging tables record the manifest path of the file each row was loaded from, so that the songplays of a log file that
+# has changed since it was loaded can be deleted and loaded again.  The columns are added to tables created before they were
+source_path_column_add_queries = ["ALTER TABLE songplays ADD COLUMN IF NOT EXISTS source_path varchar",
+                                  "ALTER TABLE IF EXISTS staging_events ADD COLUMN IF NOT EXISTS source_path varchar",
+                                  "ALTER TABLE IF EXISTS staging_songs ADD COLUMN IF NOT EXISTS source_path varchar"]
+
 # INSERT RECORDS
 
 songplay_table_insert = """INSERT INTO songplays \
-(start_time, user_id, level, song_id, artist_id, session_id, location, user_agent) \
-VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"""
+(start_time, user_id, level, song_id, artist_id, session_id, location, user_agent, source_path) \
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)"""
 
 user_table_insert = """INSERT INTO users \
 (user_id, first_name, last_name, gender, level) \
@@ -50,6 +89,124 @@ time_table_insert = """INSERT INTO time \
 VALUES (%s, %s, %s, %s, %s, %s, %s)
 ON CONFLICT (start_time) DO NOTHING"""
 
+manifest_table_insert = """INSERT INTO etl_manifest \
+(path, size, mtime, content_hash) \
+VALUES (%s, %s, %s, %s) \
+ON CONFLICT (path) DO UPDATE \
+SET size = EXCLUDED.size, mtime = EXCLUDED.mtime, content_hash = EXCLUDED.content_hash, loaded_at = now()"""
+
+# Multi-row versions of the song and artist inserts for use with psycopg2.extras.execute_values
+song_table_insert_batch = """INSERT INTO songs \
+(song_id, title, artist_id, year, duration) \
+VALUES %s \
+ON CONFLICT (song_id) DO NOTHING"""
+
+artist_table_insert_batch = """INSERT INTO artists \
+(artist_id, name, location, latitude, longitude) \
+VALUES %s \
+ON CONFLICT (artist_id) DO NOTHING"""
+
+# BULK LOAD
+
+# Temporary stage tables used by the --bulk mode of etl.py.  Each batch is copied into the stage table and then merged into the target table so that the ON CONFLICT rules above still apply.  load_order keeps the order of the user rows so that the latest level wins, as it does when the rows are inserted one at a time
+time_stage_create = """CREATE TEMP TABLE IF NOT EXISTS time_stage (LIKE time)"""
+
+user_stage_create = """CREATE TEMP TABLE IF NOT EXISTS users_stage (LIKE users, load_order serial)"""
+
+time_table_merge = """INSERT INTO time \
+(start_time, hour, day, week, month, year, weekday) \
+SELECT start_time, hour, day, week, month, year, weekday FROM time_stage \
+ON CONFLICT (start_time) DO NOTHING"""
+
+user_table_merge = """INSERT INTO users \
+(user_id, first_name, last_name, gender, level) \
+SELECT DISTINCT ON (user_id) user_id, first_name, last_name, gender, level FROM users_stage \
+ORDER BY user_id, load_order DESC \
+ON CONFLICT (user_id) DO UPDATE \
+SET level = EXCLUDED.level"""
+
+# STAGING ENGINE
+
+# Set-based inserts from the staging tables into the star schema.  They follow the same rules as the row by row inserts: the first record of a song or artist is kept, a user's level is taken from their latest event and each NextSong event becomes one songplay
+song_table_insert_staged = """INSERT INTO songs (song_id, title, artist_id, year, duration)
+    SELECT DISTINCT ON (payload->>'song_id')
+        payload->>'song_id'
+        , payload->>'title'
+        , payload->>'artist_id'
+        , (payload->>'year')::int
+        , (payload->>'duration')::numeric
+    FROM staging_songs
+    ORDER BY payload->>'song_id', load_order
+    ON CONFLICT (song_id) DO NOTHING"""
+
+artist_table_insert_staged = """INSERT INTO artists (artist_id, name, location, latitude, longitude)
+    SELECT DISTINCT ON (payload->>'artist_id')
+        payload->>'artist_id'
+        , payload->>'artist_name'
+        , payload->>'artist_location'
+        , (payload->>'artist_latitude')::numeric
+        , (payload->>'artist_longitude')::numeric
+    FROM staging_songs
+    ORDER BY payload->>'artist_id', load_order
+    ON CONFLICT (artist_id) DO NOTHING"""
+
+user_table_insert_staged = """INSERT INTO users (user_id, first_name, last_name, gender, level)
+    SELECT DISTINCT ON ((payload->>'userId')::int)
+        (payload->>'userId')::int
+        , payload->>'firstName'
+        , payload->>'lastName'
+        , payload->>'gender'
+        , payload->>'level'
+    FROM staging_events
+    WHERE payload->>'page' = 'NextSong'
+    ORDER BY (payload->>'userId')::int, (payload->>'ts')::bigint DESC, load_order DESC
+    ON CONFLICT (user_id) DO UPDATE
+    SET level = EXCLUDED.level"""
+
+# weekday is numbered from 0 for Monday to match pandas dayofweek, and week is the ISO week as in pandas weekofyear
+time_table_insert_staged = """INSERT INTO time (start_time, hour, day, week, month, year, weekday)
+    SELECT DISTINCT
+        start_time
+        , extract(hour from start_time)
+        , extract(day from start_time)
+        , extract(week from start_time)
+        , extract(month from start_time)
+        , extract(year from start_time)
+        , extract(isodow from start_time) - 1
+    FROM (SELECT TIMESTAMP 'epoch' + (payload->>'ts')::bigint * INTERVAL '1 millisecond' AS start_time
+        FROM staging_events
+        WHERE payload->>'page' = 'NextSong') events
+    ON CONFLICT (start_time) DO NOTHING"""
+
+# The song lookup is a lateral join limited to one row, as song_select only fetches the first matching song
+songplay_table_insert_staged = """INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent, source_path)
+    SELECT
+        (e.payload->>'ts')::bigint
+        , (e.payload->>'userId')::int
+        , e.payload->>'level'
+        , s.song_id
+        , s.artist_id
+        , (e.payload->>'sessionId')::int
+        , e.payload->>'location'
+        , e.payload->>'userAgent'
+        , e.source_path
+    FROM staging_events e
+    LEFT JOIN LATERAL (
+        SELECT songs.song_id, songs.artist_id
+        FROM songs JOIN artists ON songs.artist_id = artists.artist_id
+        WHERE songs.title = e.payload->>'song'
+        AND artists.name = e.payload->>'artist'
+        AND songs.duration = (e.payload->>'length')::numeric
+        LIMIT 1) s ON true
+    WHERE e.payload->>'page' = 'NextSong'
+    ORDER BY e.load_order"""
+
+# Deletes the songplays loaded from the files with the manifest paths in the list, before the files are loaded again.  It runs only for
+# files that have changed since they were loaded, which are rare, so songplays has no index on source_path to slow down its inserts
+songplay_source_delete = """DELETE FROM songplays WHERE source_path = ANY(%s)"""
+
+staging_truncate = """TRUNCATE staging_events, staging_songs RESTART IDENTITY"""
+
 # FIND SONGS
 
 # Both song_id and artist_id are in the songs table so we will take both fields from here.  We need to use artist name as one of the filter criteria in the where statement, so we join to the artists table using artist_id in order to get this field.  We will also filter on title and duration from the songs table.  The title, name and duration values will come from the record of the row is selected the etl script
@@ -57,7 +214,42 @@ song_select = ("""SELECT songs.song_id, songs.artist_id \
 FROM (songs JOIN artists ON songs.artist_id = artists.artist_id) \
 WHERE songs.title = (%s) AND artists.name = (%s) AND songs.duration = (%s)""")
 
+# The songs and artists tables are read in full to build the in-memory song lookup used by etl.py, which replaces running song_select once per log record
+song_lookup_select = """SELECT song_id, title, artist_id, duration FROM songs"""
+
+artist_lookup_select = """SELECT artist_id, name FROM artists"""
+
+manifest_select = """SELECT path, size, mtime, content_hash FROM etl_manifest"""
+
+# FULL REFRESH
+
+# Empties the star schema and the manifest so that every file is loaded again, as it is after running create_tables.py
+full_refresh_truncate = """TRUNCATE songplays, users, songs, artists, time, etl_manifest RESTART IDENTITY"""
+
+# COLUMN LISTS
+
+time_columns = ["start_time", "hour", "day", "week", "month", "year", "weekday"]
+user_columns = ["user_id", "first_name", "last_name", "gender", "level"]
+song_batch_song_fields = ["song_id", "title", "artist_id", "year", "duration"]
+song_batch_artist_fields = ["artist_id", "artist_name", "artist_location", "artist_latitude", "artist_longitude"]
+song_batch_fields = list(dict.fromkeys(song_batch_song_fields + song_batch_artist_fields))
+songplay_columns = ["start_time", "user_id", "level", "song_id", "artist_id", "session_id", "location", "user_agent", "source_path"]
+
 # QUERY LISTS
 
-create_table_queries = [songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create]
-drop_table_queries = [songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop]
\ No newline at end of file
+create_table_queries = [songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create, manifest_table_create, staging_events_table_create, staging_songs_table_create]
+drop_table_queries = [songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop, manifest_table_drop, staging_events_table_drop, staging_songs_table_drop]
+index_create_queries = [song_lookup_index_create, artist_name_index_create]
+primary_key_create_queries = {"songplays": songplay_pkey_create, "users": user_pkey_create, "songs": song_pkey_create, "artists": artist_pkey_create, "time": time_pkey_create}
+
+# In initial-load mode the star schema tables are created without their primary keys, which are added by create_tables.build_keys once the initial load is complete
+initial_load_create_table_queries = [query.replace(" PRIMARY KEY", "") for query in [songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create]] \
+    + [manifest_table_create, staging_events_table_create, staging_songs_table_create]
+
+staging_table_create_queries = [staging_events_table_create, staging_songs_table_create]
+staged_insert_queries = [song_table_insert_staged, artist_table_insert_staged, user_table_insert_staged, time_table_insert_staged, songplay_table_insert_staged]
+
+# The initial load into tables without primary keys uses the staged inserts without their ON CONFLICT clauses, which need a key to work against.  The tables are empty and DISTINCT ON already removes the duplicates in the staging tables
+# The lookup indexes are built and the songs and artists analyzed before the songplays insert, as its lateral song lookup would otherwise scan songs joined to artists once for every event
+initial_load_insert_queries = [query.split("\n    ON CONFLICT")[0] for query in staged_insert_queries[:-1]] \
+    + index_create_queries + [song_lookup_analyze, songplay_table_insert_staged]
\ No newline at end of file
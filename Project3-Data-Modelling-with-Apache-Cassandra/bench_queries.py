@@ -0,0 +1,78 @@
+import time
+import random
+import argparse
+from cassandra_loader import connect, read_events
+from query_service import LRUCache, QueryService
+
+
+def sample_keys(filepath, num_queries, seed=0):
+    """
+    - Returns num_queries keys of each query pattern drawn from the events in the event data csv file
+    - Keys are drawn in proportion to how often they appear in the events, so popular songs are asked for more often as they would be by users of the app
+    """
+    events = list(read_events(filepath))
+    rng = random.Random(seed)
+    draws = [rng.choice(events) for _ in range(num_queries)]
+    return {
+        "song_in_session": [(event['sessionId'], event['itemInSession']) for event in draws],
+        "user_session_songs": [(event['userId'], event['sessionId']) for event in draws],
+        "song_listeners": [(event['song'],) for event in draws],
+    }
+
+
+def percentile(timings, q):
+    """
+    - Returns the q percentile of the sorted timings, using the nearest rank
+    """
+    return timings[min(len(timings) - 1, int(round(q / 100 * (len(timings) - 1))))]
+
+
+def time_queries(service, pattern, keys):
+    """
+    - Runs the query pattern of the service for each key, reading every row of the result
+    - Returns the latency of each query in milliseconds, sorted
+    """
+    query = getattr(service, pattern)
+    timings = []
+    for key in keys:
+        start = time.perf_counter()
+        result = query(*key)
+        if pattern != "song_in_session":
+            list(result)
+        timings.append((time.perf_counter() - start) * 1000)
+    return sorted(timings)
+
+
+def main():
+    """
+    - Latency benchmark of the query service against the sparkify tables of a local Cassandra, loaded by cassandra_loader.py
+    - Runs --queries queries of each pattern with keys sampled from the event data, without a cache and then with an LRU cache
+    - Prints the p50, p99 and max latency of each pattern and the hit rate of the cache
+    """
+    parser = argparse.ArgumentParser(description="Measure the latency of the sparkify query patterns")
+    parser.add_argument("--hosts", nargs="+", default=["127.0.0.1"], help="contact points of the Cassandra cluster")
+    parser.add_argument("--file", default="event_datafile_new.csv", help="event data csv file the query keys are sampled from")
+    parser.add_argument("--queries", type=int, default=1000, help="number of queries run for each pattern")
+    parser.add_argument("--fetch-size", type=int, default=100, help="number of rows read in each page")
+    parser.add_argument("--cache-size", type=int, default=1024, help="number of results held by the LRU cache")
+    parser.add_argument("--cache-ttl", type=float, default=60.0, help="seconds a cached result is used for")
+    args = parser.parse_args()
+
+    cluster, session = connect(args.hosts)
+    keys = sample_keys(args.file, args.queries)
+
+    print('{:<22}{:<8}{:>10}{:>10}{:>10}{:>10}'.format('pattern', 'cache', 'p50 ms', 'p99 ms', 'max ms', 'hit rate'))
+    for pattern, pattern_keys in keys.items():
+        for cache in (None, LRUCache(args.cache_size, args.cache_ttl)):
+            service = QueryService(session, args.fetch_size, cache)
+            timings = time_queries(service, pattern, pattern_keys)
+            hit_rate = '{:.0%}'.format(cache.hits / len(pattern_keys)) if cache else '-'
+            print('{:<22}{:<8}{:>10.3f}{:>10.3f}{:>10.3f}{:>10}'.format(
+                pattern, 'lru' if cache else 'none', percentile(timings, 50), percentile(timings, 99), timings[-1], hit_rate))
+
+    session.shutdown()
+    cluster.shutdown()
+
+
+if __name__ == "__main__":
+    main()
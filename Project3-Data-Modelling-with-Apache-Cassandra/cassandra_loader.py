@@ -0,0 +1,193 @@
+import csv
+import time
+import argparse
+from itertools import islice
+from cassandra import WriteTimeout, Unavailable, OperationTimedOut
+from cassandra.cluster import Cluster
+from cassandra.concurrent import execute_concurrent
+from cassandra.query import BatchStatement, BatchType
+from cql_queries import keyspace_create, create_table_queries, insert_table_queries, table_columns, table_partition_keys, event_column_types
+
+# write errors that are worth trying again, as the write may succeed once the cluster catches up
+TRANSIENT_ERRORS = (WriteTimeout, Unavailable, OperationTimedOut)
+
+# size in bytes counted for a value that is not text, when estimating the size of a batch
+VALUE_SIZE = 8
+
+
+def connect(hosts):
+    """
+    - Connects to the Cassandra cluster, creates the sparkify keyspace if it does not exist and sets it on the session
+    - Returns the cluster and the session
+    """
+    cluster = Cluster(hosts)
+    session = cluster.connect()
+    session.execute(keyspace_create)
+    session.set_keyspace('sparkify')
+    return cluster, session
+
+
+def create_tables(session):
+    """
+    - Creates each table using the queries in `create_table_queries` list
+    """
+    for query in create_table_queries:
+        session.execute(query)
+
+
+def prepare_inserts(session):
+    """
+    - Prepares the insert statement of each table once, so that only the bound values are sent for each row
+    - Returns a dictionary of table name to prepared statement
+    """
+    return {table: session.prepare(query) for table, query in insert_table_queries.items()}
+
+
+def read_events(filepath):
+    """
+    - Yields the events of the event data csv file one at a time as a dictionary of column name to value
+    - Each value is converted to its type in `event_column_types` once, however many tables it is written to
+    """
+    with open(filepath, encoding='utf8') as f:
+        csvreader = csv.reader(f)
+        header = next(csvreader)
+        converters = [event_column_types.get(column, str) for column in header]
+        for line in csvreader:
+            yield {column: convert(value) for column, convert, value in zip(header, converters, line)}
+
+
+def table_writes(statements, events):
+    """
+    - Returns the prepared statement and bound values of every write of the events, one for each event in each table in `statements`
+    """
+    tables = [(statements[table], columns) for table, columns in table_columns.items() if table in statements]
+    return [(statement, tuple(event[column] for column in columns)) for event in events for statement, columns in tables]
+
+
+def values_size(values):
+    """
+    - Returns an estimate of the size in bytes of the bound values of a write
+    """
+    return sum(len(value.encode('utf8')) if isinstance(value, str) else VALUE_SIZE for value in values)
+
+
+def partition_batches(statements, events, max_rows, max_kb):
+    """
+    - Groups the writes of the events by table and partition key, so that the writes of a session, of a user's session or of a song are sent together
+    - Returns the writes of each partition as UNLOGGED batches of at most `max_rows` writes and about `max_kb` kilobytes, keeping batches under the cluster's batch size warning threshold
+    - A partition with a single write is sent as that write rather than as a batch
+    """
+    partitions = {}
+    for event in events:
+        for table, columns in table_columns.items():
+            if table in statements:
+                key = (table,) + tuple(event[column] for column in table_partition_keys[table])
+                partitions.setdefault(key, []).append((statements[table], tuple(event[column] for column in columns)))
+
+    writes = []
+    for partition_writes in partitions.values():
+        if len(partition_writes) == 1:
+            writes.append(partition_writes[0])
+            continue
+
+        batch, batch_size = BatchStatement(batch_type=BatchType.UNLOGGED), 0
+        for statement, values in partition_writes:
+            size = values_size(values)
+            if len(batch) and (len(batch) >= max_rows or batch_size + size > max_kb * 1024):
+                writes.append((batch, None))
+                batch, batch_size = BatchStatement(batch_type=BatchType.UNLOGGED), 0
+            batch.add(statement, values)
+            batch_size += size
+        writes.append((batch, None))
+
+    return writes
+
+
+def execute_with_retries(session, writes, concurrency, max_retries):
+    """
+    - Executes each (statement, values) write with up to `concurrency` requests in flight
+    - Writes that fail with a transient error (write timeout, unavailable or client timeout) are sent again, waiting a little longer before each retry
+    - Raises the error if a write fails with any other error or still fails after `max_retries` retries
+    """
+    for attempt in range(max_retries + 1):
+        results = execute_concurrent(session, writes, concurrency=concurrency, raise_on_first_error=False)
+        failed = [(write, result) for write, (success, result) in zip(writes, results) if not success]
+        if not failed:
+            return
+
+        for write, error in failed:
+            if not isinstance(error, TRANSIENT_ERRORS) or attempt == max_retries:
+                raise error
+
+        writes = [write for write, error in failed]
+        print('{} writes timed out, retrying'.format(len(writes)))
+        time.sleep(0.1 * 2 ** attempt)
+
+
+def write_events(session, statements, events, concurrency=100, max_retries=3, chunk_size=10000, batch_rows=1, batch_kb=5):
+    """
+    - Writes each event to every table in `statements` with the columns given for the table in `table_columns`
+    - The events are written `chunk_size` at a time so that memory use does not grow with the size of the input
+    - If `batch_rows` is more than 1, the writes of each chunk that share a partition are sent as UNLOGGED batches of up to `batch_rows` writes and `batch_kb` kilobytes, so each chunk is the window that writes are grouped in
+    - Returns the number of events written and the number of requests sent
+    """
+    events = iter(events)
+    num_events, num_requests = 0, 0
+    while True:
+        chunk = list(islice(events, chunk_size))
+        if not chunk:
+            return num_events, num_requests
+        if batch_rows > 1:
+            writes = partition_batches(statements, chunk, batch_rows, batch_kb)
+        else:
+            writes = table_writes(statements, chunk)
+        execute_with_retries(session, writes, concurrency, max_retries)
+        num_events += len(chunk)
+        num_requests += len(writes)
+
+
+def load_events(session, statements, filepath, concurrency=100, max_retries=3, chunk_size=10000, batch_rows=1, batch_kb=5):
+    """
+    - Loads the event data csv file into every table in `statements` in a single pass over the file
+    - Prints the number of events, writes and requests sent and the writes/sec
+    """
+    start = time.perf_counter()
+    num_events, num_requests = write_events(session, statements, read_events(filepath), concurrency, max_retries,
+                                            chunk_size, batch_rows, batch_kb)
+    elapsed = time.perf_counter() - start
+    num_writes = num_events * len(statements)
+    print('{} events written to {} tables with {} requests in {:.2f}s ({:.0f} writes/sec)'.format(
+        num_events, len(statements), num_requests, elapsed, num_writes / elapsed if elapsed else 0))
+    return num_events
+
+
+def main():
+    """
+    - Connects to the Cassandra cluster and creates the sparkify keyspace and the query tables
+    - Prepares the insert of each table once and reads event_datafile_new.csv once, writing each event to every table with up to --concurrency writes in flight
+    - With --batch-rows above 1, the writes of each window of --window events that share a partition are sent as UNLOGGED batches capped at --batch-rows writes and --batch-kb kilobytes
+    - Writes that time out are retried up to --retries times
+    - Finally, closes the session and cluster connection
+    """
+    parser = argparse.ArgumentParser(description="Load event_datafile_new.csv into the sparkify Cassandra tables")
+    parser.add_argument("--hosts", nargs="+", default=["127.0.0.1"], help="contact points of the Cassandra cluster")
+    parser.add_argument("--file", default="event_datafile_new.csv", help="event data csv file to load")
+    parser.add_argument("--concurrency", type=int, default=100, help="number of writes in flight at a time")
+    parser.add_argument("--retries", type=int, default=3, help="number of times a timed out write is retried")
+    parser.add_argument("--window", type=int, default=10000, help="number of events read before their writes are grouped and sent")
+    parser.add_argument("--batch-rows", type=int, default=1, help="most writes sent in one UNLOGGED batch of a partition, 1 sends every write on its own")
+    parser.add_argument("--batch-kb", type=int, default=5, help="most kilobytes of values in one batch, keep below batch_size_warn_threshold_in_kb of the cluster")
+    args = parser.parse_args()
+
+    cluster, session = connect(args.hosts)
+    create_tables(session)
+
+    statements = prepare_inserts(session)
+    load_events(session, statements, args.file, args.concurrency, args.retries, args.window, args.batch_rows, args.batch_kb)
+
+    session.shutdown()
+    cluster.shutdown()
+
+
+if __name__ == "__main__":
+    main()
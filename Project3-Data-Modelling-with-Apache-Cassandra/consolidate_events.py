@@ -0,0 +1,91 @@
+import os
+import csv
+import glob
+import argparse
+import multiprocessing
+from collections import deque
+
+# columns of the daily event files that are kept in event_datafile_new.csv, in the order they are written
+EVENT_COLUMNS = ['artist', 'firstName', 'gender', 'itemInSession', 'lastName', 'length',
+                 'level', 'location', 'sessionId', 'song', 'userId']
+
+csv.register_dialect('myDialect', quoting=csv.QUOTE_ALL, skipinitialspace=True)
+
+
+def get_files(filepath):
+    """
+    - Returns the paths of all csv files in the directory and in every directory nested within it, in sorted order
+    """
+    file_path_list = []
+    for root, dirs, files in os.walk(filepath):
+        file_path_list.extend(glob.glob(os.path.join(root, '*.csv')))
+    return sorted(file_path_list)
+
+
+def read_event_file(filepath):
+    """
+    - Reads one daily event file and returns its rows with an artist, keeping only the columns in `EVENT_COLUMNS`
+    """
+    with open(filepath, 'r', encoding='utf8', newline='') as csvfile:
+        csvreader = csv.reader(csvfile)
+        header = next(csvreader)
+        positions = [header.index(column) for column in EVENT_COLUMNS]
+        artist = header.index('artist')
+        return [[line[i] for i in positions] for line in csvreader if line[artist] != '']
+
+
+def event_rows(file_path_list, workers=1):
+    """
+    - Yields the rows of the event files in the order of `file_path_list`
+    - With more than one worker the files are read by a process pool, with at most two files per worker read ahead of the rows yielded, so that memory use stays flat however many files there are
+    """
+    if workers <= 1:
+        for filepath in file_path_list:
+            yield from read_event_file(filepath)
+        return
+
+    with multiprocessing.Pool(workers) as pool:
+        pending = deque()
+        for filepath in file_path_list:
+            pending.append(pool.apply_async(read_event_file, (filepath,)))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+
+def write_event_datafile(rows, output):
+    """
+    - Writes the rows to the output csv file with the `EVENT_COLUMNS` header, one row at a time
+    - Returns the number of rows written
+    """
+    num_rows = 0
+    with open(output, 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f, dialect='myDialect')
+        writer.writerow(EVENT_COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            num_rows += 1
+    return num_rows
+
+
+def main():
+    """
+    - Finds the daily event csv files in --input, including any nested directories
+    - Streams the rows with an artist into --output (event_datafile_new.csv by default), reading the files with a pool of --workers processes
+    """
+    parser = argparse.ArgumentParser(description="Combine the daily event files into event_datafile_new.csv")
+    parser.add_argument("--input", default="event_data", help="directory holding the daily event csv files")
+    parser.add_argument("--output", default="event_datafile_new.csv", help="csv file the events are written to")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of processes used to read the event files")
+    args = parser.parse_args()
+
+    file_path_list = get_files(args.input)
+    print('{} files found in {}'.format(len(file_path_list), args.input))
+
+    num_rows = write_event_datafile(event_rows(file_path_list, args.workers), args.output)
+    print('{} rows written to {}'.format(num_rows, args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# CREATE KEYSPACE
+
+keyspace_create = ("""CREATE KEYSPACE IF NOT EXISTS sparkify
+    WITH REPLICATION = {'class': 'SimpleStrategy', 'replication_factor': 1}
+""")
+
+# DROP TABLES
+
+artist_song_length_table_drop = "DROP TABLE IF EXISTS artist_song_length_table"
+artist_song_users_table_drop = "DROP TABLE IF EXISTS artist_song_users_table"
+users_table_drop = "DROP TABLE IF EXISTS users_table"
+
+# CREATE TABLES
+
+# Query 1: artist, song title and song length heard during a sessionId and itemInSession
+artist_song_length_table_create = ("""CREATE TABLE IF NOT EXISTS artist_song_length_table (
+    sessionId int,
+    itemInSession int,
+    artist text,
+    song text,
+    length float,
+    PRIMARY KEY(sessionId, itemInSession))
+""")
+
+# Query 2: artist, song (sorted by itemInSession) and user name for a userid and sessionId
+artist_song_users_table_create = ("""CREATE TABLE IF NOT EXISTS artist_song_users_table (
+    userid int,
+    sessionId int,
+    itemInSession int,
+    artist text,
+    song text,
+    firstName text,
+    lastName text,
+    PRIMARY KEY((userid, sessionId), itemInSession))
+""")
+
+# Query 3: every user name who listened to a song
+users_table_create = ("""CREATE TABLE IF NOT EXISTS users_table (
+    song text,
+    userid int,
+    firstName text,
+    lastName text,
+    PRIMARY KEY(song, userid))
+""")
+
+# INSERT RECORDS
+
+# the inserts use ? markers as they are prepared once by the loader and then bound for every row
+artist_song_length_table_insert = ("""INSERT INTO artist_song_length_table (sessionId, itemInSession, artist, song, length)
+    VALUES (?, ?, ?, ?, ?)
+""")
+
+artist_song_users_table_insert = ("""INSERT INTO artist_song_users_table (userid, sessionId, itemInSession, artist, song, firstName, lastName)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+""")
+
+users_table_insert = ("""INSERT INTO users_table (song, userid, firstName, lastName)
+    VALUES (?, ?, ?, ?)
+""")
+
+# SELECT RECORDS
+
+# Query 1: artist, song title and song length heard during a sessionId and itemInSession
+song_in_session_select = ("""SELECT artist, song, length FROM artist_song_length_table
+    WHERE sessionId = ? AND itemInSession = ?
+""")
+
+# Query 2: artist, song (sorted by itemInSession) and user name for a userid and sessionId
+user_session_songs_select = ("""SELECT itemInSession, artist, song, firstName, lastName FROM artist_song_users_table
+    WHERE userid = ? AND sessionId = ?
+""")
+
+# Query 3: every user name who listened to a song
+song_listeners_select = ("""SELECT firstName, lastName FROM users_table
+    WHERE song = ?
+""")
+
+# QUERY TABLE COLUMNS
+
+# columns of event_datafile_new.csv bound to the insert of each table, in the order of the insert's ? markers
+# adding a query table only needs its create, its insert and an entry here, the loader writes it in the same pass over the csv
+table_columns = {
+    "artist_song_length_table": ["sessionId", "itemInSession", "artist", "song", "length"],
+    "artist_song_users_table": ["userId", "sessionId", "itemInSession", "artist", "song", "firstName", "lastName"],
+    "users_table": ["song", "userId", "firstName", "lastName"],
+}
+
+# columns of the partition key of each table, the writes of a partition are grouped into a batch by the loader
+table_partition_keys = {
+    "artist_song_length_table": ["sessionId"],
+    "artist_song_users_table": ["userId", "sessionId"],
+    "users_table": ["song"],
+}
+
+# type of the csv columns that are not text
+event_column_types = {
+    "itemInSession": int,
+    "length": float,
+    "sessionId": int,
+    "userId": int,
+}
+
+# QUERY LISTS
+
+create_table_queries = [artist_song_length_table_create, artist_song_users_table_create, users_table_create]
+drop_table_queries = [artist_song_length_table_drop, artist_song_users_table_drop, users_table_drop]
+insert_table_queries = {
+    "artist_song_length_table": artist_song_length_table_insert,
+    "artist_song_users_table": artist_song_users_table_insert,
+    "users_table": users_table_insert,
+}
@@ -0,0 +1,91 @@
+import time
+from collections import OrderedDict
+from cql_queries import song_in_session_select, user_session_songs_select, song_listeners_select
+
+
+class LRUCache:
+    """
+    Least recently used cache of query results with an expiry time.
+
+    - Holds at most max_size results, dropping the least recently used result when a new one is added
+    - A result older than ttl seconds is treated as missing, so hot keys are read again from Cassandra at least every ttl seconds
+    """
+
+    def __init__(self, max_size=1024, ttl=60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """
+        - Returns the cached result of the key, or None if it is not cached or has expired
+        """
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, result):
+        self._entries[key] = (time.monotonic(), result)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+class QueryService:
+    """
+    Read path for the three sparkify query patterns, with one method for each query table.
+
+    - The select of each pattern is prepared once when the service is created
+    - Results are read fetch_size rows at a time, with the next page only fetched as the rows are iterated
+    - If a cache is given, results are kept in it by pattern and key and read in full, so that hot keys such as popular songs are served without a request to Cassandra
+    """
+
+    def __init__(self, session, fetch_size=100, cache=None):
+        self.session = session
+        self.fetch_size = fetch_size
+        self.cache = cache
+        self._song_in_session = session.prepare(song_in_session_select)
+        self._user_session_songs = session.prepare(user_session_songs_select)
+        self._song_listeners = session.prepare(song_listeners_select)
+
+    def _query(self, statement, values):
+        """
+        - Returns the rows of the prepared statement bound to the values, from the cache if it holds them
+        - Without a cache the rows are returned as a lazily paged iterator, otherwise as a list that is added to the cache
+        """
+        bound = statement.bind(values)
+        bound.fetch_size = self.fetch_size
+        if self.cache is None:
+            return iter(self.session.execute(bound))
+
+        key = (statement.query_string, values)
+        rows = self.cache.get(key)
+        if rows is None:
+            rows = list(self.session.execute(bound))
+            self.cache.put(key, rows)
+        return rows
+
+    def song_in_session(self, session_id, item_in_session):
+        """
+        - Query 1: returns the artist, song and length heard during the session and item in session, or None if there is none
+        """
+        return next(iter(self._query(self._song_in_session, (session_id, item_in_session))), None)
+
+    def user_session_songs(self, user_id, session_id):
+        """
+        - Query 2: returns the item in session, artist, song and user first and last name of each song played by the user in the session, sorted by item in session
+        """
+        return self._query(self._user_session_songs, (user_id, session_id))
+
+    def song_listeners(self, song):
+        """
+        - Query 3: returns the first and last name of every user who listened to the song
+        """
+        return self._query(self._song_listeners, (song,))
@@ -0,0 +1,154 @@
+import os
+import gzip
+import json
+import argparse
+
+
+class LocalStorage:
+    """
+    Files in a local directory, used in place of S3 to run the compaction offline.  Keys are paths relative to root.
+    """
+
+    def __init__(self, root='.'):
+        self.root = root
+
+    def list_files(self, prefix):
+        """
+        - Returns the key and size of every file under the prefix, in sorted order
+        """
+        files = []
+        for root, dirs, filenames in os.walk(os.path.join(self.root, prefix)):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                files.append((os.path.relpath(path, self.root), os.path.getsize(path)))
+        return sorted(files)
+
+    def read(self, key):
+        with open(os.path.join(self.root, key), 'rb') as f:
+            return f.read()
+
+    def write(self, key, data):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def url(self, key):
+        return os.path.abspath(os.path.join(self.root, key))
+
+
+class S3Storage:
+    """
+    Files in an S3 bucket, or in an S3 compatible stand-in such as MinIO when an endpoint_url is given.
+    """
+
+    def __init__(self, bucket, endpoint_url=None):
+        import boto3
+        self.bucket = bucket
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+
+    def list_files(self, prefix):
+        """
+        - Returns the key and size of every object under the prefix, in sorted order
+        """
+        files = []
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix):
+            files.extend((item['Key'], item['Size']) for item in page.get('Contents', []))
+        return sorted(files)
+
+    def read(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+
+    def write(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data)
+
+    def url(self, key):
+        return 's3://{}/{}'.format(self.bucket, key)
+
+
+def open_storage(location, endpoint_url=None):
+    """
+    - Returns the storage and prefix of a location, an s3://bucket/prefix url or a local directory
+    - Local prefixes are made relative to the current directory, the same form as the keys listed by LocalStorage
+    """
+    if location.startswith('s3://'):
+        bucket, _, prefix = location[len('s3://'):].partition('/')
+        return S3Storage(bucket, endpoint_url), prefix
+    return LocalStorage(), os.path.relpath(location)
+
+
+def plan_chunks(files, num_slices, target_mb):
+    """
+    - Splits the files into chunks of about target_mb of input each, with the number of chunks rounded up to a multiple of num_slices so that every slice of the cluster loads the same number of chunks
+    - Files are placed largest first into the chunk with the least data so far, which keeps the chunks close to the same size
+    - Returns a list of chunks, each a list of (key, size)
+    """
+    total_size = sum(size for key, size in files)
+    num_chunks = max(1, -(-total_size // (target_mb * 1024 * 1024)))
+    num_chunks = min(len(files), -(-num_chunks // num_slices) * num_slices) or 1
+
+    chunks = [[] for _ in range(num_chunks)]
+    chunk_sizes = [0] * num_chunks
+    for key, size in sorted(files, key=lambda item: item[1], reverse=True):
+        smallest = chunk_sizes.index(min(chunk_sizes))
+        chunks[smallest].append((key, size))
+        chunk_sizes[smallest] += size
+    return [sorted(chunk) for chunk in chunks]
+
+
+def write_chunks(storage, chunks, output_prefix):
+    """
+    - Writes the files of each chunk, one after the other with a newline between them, as a gzip file under the output prefix
+    - Returns the key and compressed size of each chunk written
+    """
+    written = []
+    for i, chunk in enumerate(chunks):
+        data = b''.join(contents if contents.endswith(b'\n') else contents + b'\n'
+                        for contents in (storage.read(key) for key, size in chunk))
+        key = '{}/part-{:05d}.json.gz'.format(output_prefix.rstrip('/'), i)
+        compressed = gzip.compress(data)
+        storage.write(key, compressed)
+        written.append((key, len(compressed)))
+    return written
+
+
+def write_manifest(storage, parts, manifest_key):
+    """
+    - Writes a Redshift COPY manifest listing each part as a mandatory entry with its content length
+    """
+    manifest = {"entries": [{"url": storage.url(key), "mandatory": True, "meta": {"content_length": size}} for key, size in parts]}
+    storage.write(manifest_key, json.dumps(manifest, indent=2).encode('utf8'))
+
+
+def main():
+    """
+    - Lists the files ending in --suffix under --source, a local directory or an s3://bucket/prefix url
+    - Compacts them into gzip chunks of about --target-mb each, with a multiple of --slices chunks, under --output, which must be in the same storage as --source
+    - Writes the COPY manifest listing the chunks to <output>/manifest.json, for use by `etl.py --manifest`
+    """
+    parser = argparse.ArgumentParser(description="Compact small input files into gzip chunks and write a Redshift COPY manifest")
+    parser.add_argument("--source", required=True, help="directory or s3://bucket/prefix holding the input files")
+    parser.add_argument("--output", required=True, help="directory or s3://bucket/prefix, in the same storage as --source, that the chunks and manifest are written to")
+    parser.add_argument("--suffix", default=".json", help="only files ending in this suffix are compacted")
+    parser.add_argument("--slices", type=int, default=4, help="number of slices of the cluster")
+    parser.add_argument("--target-mb", type=int, default=64, help="size of input data in each chunk, in MB")
+    parser.add_argument("--endpoint-url", help="endpoint of an S3 compatible stand-in")
+    args = parser.parse_args()
+
+    storage, prefix = open_storage(args.source, args.endpoint_url)
+    output_storage, output_prefix = open_storage(args.output, args.endpoint_url)
+    if type(output_storage) is not type(storage) or getattr(output_storage, 'bucket', None) != getattr(storage, 'bucket', None):
+        parser.error("--output must be in the same storage as --source, the same S3 bucket or both local directories")
+    output_prefix = output_prefix.rstrip('/')
+    files = [(key, size) for key, size in storage.list_files(prefix)
+             if key.endswith(args.suffix) and not key.startswith(output_prefix + '/')]
+    print('{} files found in {}, {:.1f} MB'.format(len(files), args.source, sum(size for key, size in files) / 1024 / 1024))
+
+    chunks = plan_chunks(files, args.slices, args.target_mb)
+    parts = write_chunks(storage, chunks, output_prefix)
+    write_manifest(storage, parts, '{}/manifest.json'.format(output_prefix))
+    print('{} chunks and manifest.json written to {}'.format(len(parts), args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import re
+import argparse
 import configparser
 import psycopg2
 from sql_queries import create_table_queries, drop_table_queries
@@ -12,12 +14,23 @@ def drop_tables(cur, conn):
         conn.commit()
 
 
-def create_tables(cur, conn):
+def postgres_table_create(query):
+    """
+    - Returns the CREATE TABLE statement with its Redshift only parts replaced, so that the tables can be created on a local Postgres
+    - identity columns become serial and distkey, sortkey and diststyle are dropped
+    - PRIMARY KEY is dropped as well, as Redshift does not enforce primary keys and the inserts rely on them not being enforced
+    """
+    query = query.replace("integer identity(0,1)", "serial")
+    return re.sub(r"\s+(distkey|sortkey|diststyle even|PRIMARY KEY)\b", "", query)
+
+
+def create_tables(cur, conn, postgres=False):
     """
     - Creates tables if they do not exist
+    - With postgres, the statements are first changed by postgres_table_create
     """
     for query in create_table_queries:
-        cur.execute(query)
+        cur.execute(postgres_table_create(query) if postgres else query)
         conn.commit()
 
 
@@ -26,16 +39,21 @@ def main():
     - Reads in user parameters for AWS
     - Establishes connection to Redshift Cluster
     - Calls drop_tables and create_tables functions so that we have the tables set up ready for ETL
+    - With --dsn, connects to that database instead, taken to be a local Postgres, and creates the tables with the Postgres DDL of postgres_table_create
     - Closes connection to Redshift Cluster
     """
+    parser = argparse.ArgumentParser(description="Create the sparkify data warehouse tables")
+    parser.add_argument("--dsn", help="connection string of a local Postgres to create the tables on in place of the CLUSTER settings of dwh.cfg")
+    args = parser.parse_args()
+
     config = configparser.ConfigParser()
     config.read('dwh.cfg')
 
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+    conn = psycopg2.connect(args.dsn or "host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
     cur = conn.cursor()
 
     drop_tables(cur, conn)
-    create_tables(cur, conn)
+    create_tables(cur, conn, postgres=bool(args.dsn))
 
     conn.close()
 
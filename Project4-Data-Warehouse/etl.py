@@ -1,42 +1,199 @@
+import os
+import glob
+import json
+import argparse
 import configparser
+from datetime import datetime
 import psycopg2
-from sql_queries import copy_table_queries, insert_table_queries
+from psycopg2.extras import execute_values
+from sql_queries import copy_table_queries, insert_table_queries, load_steps, staging_truncate_queries, \
+    manifest_copy_table_queries, manifest_copy_steps, \
+    incremental_table_queries, high_water_mark_select, high_water_mark_insert, songplay_join_validation, staging_events_prefix_copy, \
+    statement_names, staging_events_columns, staging_songs_columns, staging_events_raw_insert, staging_songs_raw_insert
+from scheduler import run_steps
+from load_profiler import LoadProfiler
 
 
-def load_staging_tables(cur, conn):
+def load_staging_tables(cur, conn, queries=copy_table_queries, profiler=None):
     """
     - Calls procedure to copy tables from S3 to Redshift staging area
+    - If a LoadProfiler is given, each statement is run through it so that its time, rows and plan are recorded
     """
-    for query in copy_table_queries:
-        cur.execute(query)
+    execute = profiler.execute if profiler else cur.execute
+    for query in queries:
+        execute(query)
         conn.commit()
 
 
-def insert_tables(cur, conn):
+def insert_tables(cur, conn, profiler=None):
     """
     - Calls procedure to run insert queries which will populate analytical tables in Redshift with the data in the Redshift staging area
+    - If a LoadProfiler is given, each statement is run through it so that its time, rows and plan are recorded
     """
+    execute = profiler.execute if profiler else cur.execute
     for query in insert_table_queries:
+        execute(query)
+        conn.commit()
+
+
+def load_local_staging_tables(cur, conn, data_dir):
+    """
+    - Fills staging_events_raw and staging_songs_raw from the JSON files under data_dir/log_data and data_dir/song_data, in place of the S3 COPY statements, so that the load can be run on a local Postgres
+    - Fields are matched to the columns by name whatever their case, as the log_json_path.json used by the COPY does, and empty strings are loaded as NULL
+    """
+    for folder, columns, query in [("log_data", staging_events_columns, staging_events_raw_insert),
+                                   ("song_data", staging_songs_columns, staging_songs_raw_insert)]:
+        column_names = [column.lower() for column in columns.split(", ")]
+        rows = []
+        for path in sorted(glob.glob(os.path.join(data_dir, folder, "**", "*.json"), recursive=True)):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        record = {key.lower(): value for key, value in json.loads(line).items()}
+                        rows.append([None if record.get(column) == "" else record.get(column) for column in column_names])
+        execute_values(cur, query, rows)
+        print('{} rows loaded from {}'.format(len(rows), os.path.join(data_dir, folder)))
+    conn.commit()
+
+
+def validate_song_join(cur):
+    """
+    - Runs `songplay_join_validation` on the loaded staging tables and prints the number of event and song pairs matched by the join on song_key and by the join on the song title, artist name and length
+    - Returns True if both joins match the same pairs
+    """
+    cur.execute(songplay_join_validation)
+    old_rows, new_rows, old_only, new_only = cur.fetchone()
+    print('song join: {} pairs on title, artist and length, {} pairs on song_key, {} only on title, artist and length, {} only on song_key'.format(
+        old_rows, new_rows, old_only, new_only))
+    return old_only == 0 and new_only == 0
+
+
+def truncate_staging_tables(cur, conn):
+    """
+    - Empties the staging tables, so that they only hold the data copied by this run
+    """
+    for query in staging_truncate_queries:
         cur.execute(query)
         conn.commit()
 
 
+def incremental_tables(cur, conn, profiler=None):
+    """
+    - Reads the high-water mark of staging_events.ts left by the last load, or the latest time loaded if load_state is empty, 0 if nothing has been loaded
+    - Inserts only the events newer than the high-water mark into songplays and time, and replaces the users, songs and artists rows whose keys are found in the staging tables
+    - Records the new high-water mark and commits everything in one transaction, so that a failed run leaves the tables and the high-water mark as they were
+    - If a LoadProfiler is given, each statement is run through it so that its time, rows and plan are recorded
+    - Returns the high-water mark the run started from
+    """
+    cur.execute(high_water_mark_select)
+    high_water_mark = cur.fetchone()[0]
+    params = {"high_water_mark": high_water_mark, "loaded_at": datetime.now()}
+
+    execute = profiler.execute if profiler else cur.execute
+    for query in incremental_table_queries:
+        execute(query, params)
+    cur.execute(high_water_mark_insert, params)
+    conn.commit()
+
+    return high_water_mark
+
+
+def record_high_water_mark(cur, conn):
+    """
+    - Records the latest staging_events.ts loaded by a full load as the high-water mark, so that the next incremental run starts after it
+    """
+    cur.execute(high_water_mark_insert, {"high_water_mark": 0, "loaded_at": datetime.now()})
+    conn.commit()
+
+
 def main():
     """
     - Main function that will allow running of the S3 to Redshift ETL process
     - Establishes connection to Redshift Cluster
     - Gets cursor for PostgreSQL session
     - Calls functions load_staging_tables and insert_tables which will perform the ETL processes
+    - Empties the staging tables with truncate_staging_tables before every load, so that re-runs do not duplicate the staged rows
+    - With --incremental, calls incremental_tables in place of insert_tables, so that only new events are loaded
+    - With --log-prefix, the events are copied from that S3 prefix in place of LOG_DATA, so that an incremental run only copies the log files of the new days
+    - A full load records the high-water mark with record_high_water_mark, so that a later incremental run starts after the events it loaded
+    - With --workers above 1, runs the statements in `load_steps` on a pool of connections instead, so that the two COPY statements and the dimension inserts run at the same time and songplays is inserted once both staging tables are loaded
+    - With --manifest, the staging tables are loaded from the gzip chunks listed in the COPY manifests written by copy_manifest.py, set by LOG_MANIFEST and SONG_MANIFEST in dwh.cfg, which must not be empty
+    - With --profile, records the EXPLAIN output, elapsed time and rows affected of each statement in the load_history table, under its name in statement_names, and flags statements that are more than --regression-threshold slower than the average of their last --history-runs runs.  Statements are then run one at a time on one connection, whatever --workers is set to
+    - With --validate-join, calls validate_song_join once the load is complete
+    - With --local-data, the raw staging tables are filled from local JSON files by load_local_staging_tables in place of the COPY statements, so that with --dsn the load runs on a local Postgres set up by `create_tables.py --dsn`
     - Closes connection to Redshift Cluster
     """
+    parser = argparse.ArgumentParser(description="Load the sparkify data warehouse from S3")
+    parser.add_argument("--workers", type=int, default=1, help="number of connections used to run independent statements at the same time")
+    parser.add_argument("--incremental", action="store_true", help="load only the events newer than the last run and replace changed dimension rows")
+    parser.add_argument("--log-prefix", help="S3 prefix of the log files to copy in place of LOG_DATA, for example s3://udacity-dend/log_data/2018/11/2018-11-30")
+    parser.add_argument("--manifest", action="store_true", help="copy the staging tables from the manifests written by copy_manifest.py")
+    parser.add_argument("--profile", action="store_true", help="record the plan, time and rows of each statement in load_history")
+    parser.add_argument("--regression-threshold", type=float, default=0.5, help="flag statements this much slower than their previous runs, 0.5 is 50%%")
+    parser.add_argument("--history-runs", type=int, default=5, help="number of previous runs a statement is compared with")
+    parser.add_argument("--validate-join", action="store_true", help="check that the join on song_key matches the same songs as the join on title, artist and length")
+    parser.add_argument("--dsn", help="connection string to use in place of the CLUSTER settings of dwh.cfg, for example a local Postgres")
+    parser.add_argument("--local-data", help="folder holding song_data and log_data JSON files to load into staging in place of the S3 COPY statements")
+    args = parser.parse_args()
+    if args.local_data and (args.manifest or args.log_prefix):
+        parser.error("--local-data replaces the COPY statements and cannot be used with --manifest or --log-prefix")
+
     config = configparser.ConfigParser()
     config.read('dwh.cfg')
+    if args.manifest:
+        missing = [name for name in ("LOG_MANIFEST", "SONG_MANIFEST") if not config['S3'].get(name, "").strip("'\" ")]
+        if missing:
+            parser.error("--manifest needs {} set in the S3 section of dwh.cfg".format(" and ".join(missing)))
+    dsn = args.dsn or "host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values())
 
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+    steps, staging_queries = load_steps, copy_table_queries
+    if args.manifest:
+        steps = {name: (manifest_copy_steps.get(name, query), depends_on) for name, (query, depends_on) in load_steps.items()}
+        staging_queries = manifest_copy_table_queries
+
+    conn = psycopg2.connect(dsn)
     cur = conn.cursor()
-    
-    load_staging_tables(cur, conn)
-    insert_tables(cur, conn)
+    names = statement_names
+    if args.log_prefix:
+        events_copy = cur.mogrify(staging_events_prefix_copy, {"log_prefix": args.log_prefix}).decode()
+        steps = dict(steps, staging_events_copy=(events_copy, steps["staging_events_copy"][1]))
+        staging_queries = [events_copy] + staging_queries[1:]
+        names = dict(statement_names, **{events_copy: "staging_events_prefix_copy"})
+    copy_steps = ("staging_events_copy", "staging_songs_copy")
+    if args.local_data:
+        steps = {name: (query, [step for step in depends_on if step not in copy_steps]) for name, (query, depends_on) in steps.items() if name not in copy_steps}
+        staging_queries = staging_queries[len(copy_steps):]
+    profiler = LoadProfiler(cur, conn, args.regression_threshold, args.history_runs, names) if args.profile else None
+    workers = 1 if args.profile else args.workers
+
+    # every load starts from empty staging tables, as the COPY statements and key inserts add to what they hold
+    truncate_staging_tables(cur, conn)
+    if args.local_data:
+        load_local_staging_tables(cur, conn, args.local_data)
+
+    if workers > 1 and not args.incremental:
+        run_steps(dsn, steps, workers)
+        record_high_water_mark(cur, conn)
+    elif args.incremental:
+        if workers > 1:
+            staging_steps = copy_steps + ("staging_events_key", "staging_songs_key")
+            run_steps(dsn, {name: steps[name] for name in staging_steps if name in steps}, workers)
+        else:
+            load_staging_tables(cur, conn, staging_queries, profiler)
+        high_water_mark = incremental_tables(cur, conn, profiler)
+        print('events after ts {:.0f} loaded'.format(high_water_mark))
+    else:
+        load_staging_tables(cur, conn, staging_queries, profiler)
+        insert_tables(cur, conn, profiler)
+        record_high_water_mark(cur, conn)
+
+    if profiler:
+        for name, elapsed, previous_seconds in profiler.regressions():
+            print('{} took {:.2f}s, more than {:.0%} slower than its average of {:.2f}s'.format(
+                name, elapsed, args.regression_threshold, previous_seconds))
+
+    if args.validate_join and not validate_song_join(cur):
+        print('the join on song_key does not match the same songs as the join on title, artist and length')
 
     conn.close()
 
@@ -0,0 +1,76 @@
+import time
+from datetime import datetime
+from sql_queries import load_history_table_create, load_history_insert, load_history_previous_select, statement_names
+
+# statements that EXPLAIN can describe, COPY is run without a plan
+EXPLAINED_STATEMENTS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+
+def statement_name(query, names=statement_names):
+    """
+    - Returns the name a statement is recorded under in load_history, its name in names, for example `songplays` or `songplays_incremental`
+    - Statements that are not in names are named by their command and table, for example `INSERT INTO songplays`
+    """
+    if query in names:
+        return names[query]
+    words = query.split()
+    return ' '.join(words[:3] if words[0].upper() in ('INSERT', 'DELETE') else words[:2])
+
+
+class LoadProfiler:
+    """
+    Runs the statements of a load, recording the elapsed time, rows affected and query plan of each one in the load_history table.
+
+    - Each statement is compared with its average elapsed time over its last history_runs runs, and flagged as regressed if it is more than threshold (0.5 is 50%) slower
+    - Statements are named by statement_name from names, statement_names by default, or by the name passed to execute.  A statement run more than once in a load is recorded once for each run
+    """
+
+    def __init__(self, cur, conn, threshold=0.5, history_runs=5, names=statement_names):
+        self.cur = cur
+        self.conn = conn
+        self.threshold = threshold
+        self.history_runs = history_runs
+        self.names = names
+        self.run_id = datetime.now().strftime('%Y%m%d%H%M%S')
+        self.results = []
+        cur.execute(load_history_table_create)
+        conn.commit()
+
+    def explain(self, query, params=None):
+        """
+        - Returns the EXPLAIN output of the statement, or None for statements such as COPY that cannot be explained
+        """
+        if query.split()[0].upper() not in EXPLAINED_STATEMENTS:
+            return None
+        self.cur.execute('EXPLAIN ' + query, params)
+        return '\n'.join(row[0] for row in self.cur.fetchall())[:65535]
+
+    def execute(self, query, params=None, name=None):
+        """
+        - Records the statement under name, or under its statement_name if no name is given
+        - Captures the plan of the statement, runs it and records its elapsed time and rows affected in load_history
+        - Prints the statement with its elapsed time, flagging it if it has regressed
+        """
+        name = name or statement_name(query, self.names)
+        plan = self.explain(query, params)
+
+        started_at = datetime.now()
+        start = time.perf_counter()
+        self.cur.execute(query, params)
+        elapsed = time.perf_counter() - start
+        rows_affected = self.cur.rowcount
+
+        self.cur.execute(load_history_previous_select, (name, self.run_id, self.history_runs))
+        previous_seconds, previous_runs = self.cur.fetchone()
+        regressed = bool(previous_runs) and elapsed > previous_seconds * (1 + self.threshold)
+
+        self.cur.execute(load_history_insert, (self.run_id, name, started_at, elapsed, rows_affected, plan, regressed))
+        self.results.append((name, elapsed, rows_affected, previous_seconds, regressed))
+        print('{:<32}{:>10.2f}s{:>12} rows{}'.format(name, elapsed, rows_affected,
+              '  REGRESSED from {:.2f}s'.format(previous_seconds) if regressed else ''))
+
+    def regressions(self):
+        """
+        - Returns the name, elapsed time and previous average elapsed time of each statement of this run that regressed
+        """
+        return [(name, elapsed, previous_seconds) for name, elapsed, rows_affected, previous_seconds, regressed in self.results if regressed]
@@ -0,0 +1,73 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from psycopg2.pool import ThreadedConnectionPool
+
+
+def run_step(pool, query):
+    """
+    - Runs the query on a connection taken from the pool and commits it
+    - Returns the number of rows affected and the elapsed time in seconds
+    """
+    conn = pool.getconn()
+    try:
+        start = time.perf_counter()
+        with conn.cursor() as cur:
+            cur.execute(query)
+            num_rows = cur.rowcount
+        conn.commit()
+        return num_rows, time.perf_counter() - start
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+def ready_steps(steps, done, running):
+    """
+    - Returns the names of the steps that have not been started and whose dependencies have all finished
+    """
+    return [name for name, (query, depends_on) in steps.items()
+            if name not in done and name not in running and all(step in done for step in depends_on)]
+
+
+def run_steps(dsn, steps, workers=4):
+    """
+    - Runs a dictionary of step name to (query, names of the steps it depends on) on a pool of up to `workers` connections
+    - Each step is started as soon as the steps it depends on have finished, so that independent steps run at the same time
+    - If a step fails no further steps are started, the steps already running are waited for and the error is raised
+    - Prints the start time, elapsed time and rows affected of each step
+    - Returns a dictionary of step name to (start time, elapsed seconds, rows affected)
+    """
+    for name, (query, depends_on) in steps.items():
+        unknown = [step for step in depends_on if step not in steps]
+        if unknown:
+            raise ValueError('{} depends on unknown steps {}'.format(name, unknown))
+
+    pool = ThreadedConnectionPool(1, workers, dsn)
+    timings = {}
+    running = {}
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(workers) as executor:
+            while len(timings) < len(steps):
+                for name in ready_steps(steps, timings, running.values()):
+                    running[executor.submit(run_step, pool, steps[name][0])] = name
+                if not running:
+                    raise ValueError('steps {} have circular dependencies'.format([name for name in steps if name not in timings]))
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    num_rows, seconds = future.result()
+                    timings[name] = (time.perf_counter() - start - seconds, seconds, num_rows)
+    finally:
+        pool.closeall()
+
+    elapsed = time.perf_counter() - start
+    print('{:<24}{:>10}{:>10}{:>12}'.format('statement', 'start s', 'seconds', 'rows'))
+    for name, (started, seconds, num_rows) in sorted(timings.items(), key=lambda item: item[1][0]):
+        print('{:<24}{:>10.2f}{:>10.2f}{:>12}'.format(name, started, seconds, num_rows))
+    print('{} statements in {:.2f}s, {:.2f}s of statement time'.format(len(timings), elapsed, sum(t[1] for t in timings.values())))
+
+    return timings
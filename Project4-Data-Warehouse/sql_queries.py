@@ -9,16 +9,54 @@ config.read('dwh.cfg')
 
 staging_events_table_drop = "DROP TABLE IF EXISTS staging_events"
 staging_songs_table_drop = "DROP TABLE IF EXISTS staging_songs"
+staging_events_raw_table_drop = "DROP TABLE IF EXISTS staging_events_raw"
+staging_songs_raw_table_drop = "DROP TABLE IF EXISTS staging_songs_raw"
 songplay_table_drop = "DROP TABLE IF EXISTS songplays"
 user_table_drop = "DROP TABLE IF EXISTS users"
 song_table_drop = "DROP TABLE IF EXISTS songs"
 artist_table_drop = "DROP TABLE IF EXISTS artists"
 time_table_drop = "DROP TABLE IF EXISTS time"
+load_state_table_drop = "DROP TABLE IF EXISTS load_state"
+
+# SONG JOIN KEY
+
+# staging_events and staging_songs are joined on a hash of the trimmed song title, the trimmed artist name and the song duration rounded to
+# 5 decimal places (the precision of the source data), so that songplays is built from a single column join.  Both staging tables are
+# distributed and sorted on the key, so that the join is co-located on each slice.  The COPY statements load the unkeyed
+# staging_events_raw and staging_songs_raw tables, spread evenly over the slices, and the rows are then inserted into the keyed tables
+# with the key computed in the select, so that they are distributed on the key and written sorted rather than all landing on one slice
+# with a NULL key and being left unsorted by an UPDATE.
+song_key_expression = "MD5(TRIM({title}) || '|' || TRIM({artist}) || '|' || CAST(CAST({duration} AS DECIMAL(18,5)) AS VARCHAR))"
 
 # CREATE TABLES
 
 # Redshift data types identified using AWS documentation
     # https://docs.aws.amazon.com/redshift/latest/dg/c_Supported_data_types.html
+staging_events_raw_table_create = ("""
+    CREATE TABLE IF NOT EXISTS staging_events_raw
+    (
+        artist varchar
+        , auth varchar
+        , firstName varchar
+        , gender varchar
+        , iteminSession smallint
+        , lastName varchar
+        , length double precision
+        , level varchar
+        , location varchar
+        , method varchar
+        , page varchar
+        , registration double precision
+        , sessionId integer
+        , song varchar
+        , status integer
+        , ts double precision
+        , userAgent varchar
+        , userId integer
+    )
+    diststyle even
+    """)
+
 staging_events_table_create= ("""
     CREATE TABLE IF NOT EXISTS staging_events
     (
@@ -35,13 +73,30 @@ staging_events_table_create= ("""
         , page varchar
         , registration double precision
         , sessionId integer
-        , song varchar sortkey
+        , song varchar
         , status integer
         , ts double precision
         , userAgent varchar
         , userId integer
+        , song_key varchar(32) distkey sortkey
+    )
+    """)
 
+staging_songs_raw_table_create = ("""
+    CREATE TABLE IF NOT EXISTS staging_songs_raw
+    (
+        num_songs smallint
+        , artist_id varchar
+        , artist_latitude double precision
+        , artist_longitude double precision
+        , artist_location varchar
+        , artist_name varchar
+        , song_id varchar
+        , title varchar
+        , duration double precision
+        , year integer
     )
+    diststyle even
     """)
 
 staging_songs_table_create = ("""
@@ -54,9 +109,10 @@ staging_songs_table_create = ("""
         , artist_location varchar
         , artist_name varchar
         , song_id varchar
-        , title varchar sortkey
+        , title varchar
         , duration double precision
         , year integer
+        , song_key varchar(32) distkey sortkey
     )
     """)
 
@@ -121,26 +177,103 @@ time_table_create = """
     )
     """
 
+# high-water marks of the incremental loads, one row is added for each run that loads new data
+load_state_table_create = """
+    CREATE TABLE IF NOT EXISTS load_state
+    (
+        name varchar NOT NULL
+        , high_water_mark double precision NOT NULL
+        , loaded_at timestamp NOT NULL
+    )
+    """
+
+# elapsed time, rows affected and query plan of every statement of each load, kept when the other tables are dropped so that runs can be compared
+load_history_table_create = """
+    CREATE TABLE IF NOT EXISTS load_history
+    (
+        run_id varchar NOT NULL
+        , statement varchar NOT NULL
+        , started_at timestamp NOT NULL
+        , elapsed_seconds double precision NOT NULL
+        , rows_affected bigint
+        , query_plan varchar(65535)
+        , regressed boolean
+    )
+    """
+
 # STAGING TABLES
 
+staging_events_truncate = "TRUNCATE staging_events"
+staging_songs_truncate = "TRUNCATE staging_songs"
+staging_events_raw_truncate = "TRUNCATE staging_events_raw"
+staging_songs_raw_truncate = "TRUNCATE staging_songs_raw"
+
+# the COPY statements load the JSON into the raw staging tables, song_key is added when the rows are inserted into the keyed tables
 staging_events_copy = ("""
-COPY staging_events FROM {}
+COPY staging_events_raw (artist, auth, firstName, gender, iteminSession, lastName, length, level, location, method, page, registration,
+    sessionId, song, status, ts, userAgent, userId)
+FROM {}
 credentials 'aws_iam_role={}'
 format as json {} region 'us-west-2'
 """).format(config['S3']['log_data'],config['IAM_ROLE']['ARN'],config['S3']['log_jsonpath'])
 
 staging_songs_copy = ("""
-COPY staging_songs FROM {}
+COPY staging_songs_raw (num_songs, artist_id, artist_latitude, artist_longitude, artist_location, artist_name, song_id, title, duration, year)
+FROM {}
 credentials 'aws_iam_role={}'
 json region 'us-west-2'
 """).format(config['S3']['song_data'],config['IAM_ROLE']['ARN'])
 
+# the prefix COPY statement loads only the log files under %(log_prefix)s, for example the prefix of one day, so that an incremental run
+# copies the new events rather than the whole of log_data
+staging_events_prefix_copy = ("""
+COPY staging_events_raw (artist, auth, firstName, gender, iteminSession, lastName, length, level, location, method, page, registration,
+    sessionId, song, status, ts, userAgent, userId)
+FROM %(log_prefix)s
+credentials 'aws_iam_role={}'
+format as json {} region 'us-west-2'
+""").format(config['IAM_ROLE']['ARN'], config['S3']['log_jsonpath'])
+
+# the manifest COPY statements load the gzip chunks listed in the manifests written by copy_manifest.py
+staging_events_manifest_copy = ("""
+COPY staging_events_raw (artist, auth, firstName, gender, iteminSession, lastName, length, level, location, method, page, registration,
+    sessionId, song, status, ts, userAgent, userId)
+FROM {}
+credentials 'aws_iam_role={}'
+format as json {} gzip manifest region 'us-west-2'
+""").format(config['S3'].get('log_manifest', "''"), config['IAM_ROLE']['ARN'], config['S3']['log_jsonpath'])
+
+staging_songs_manifest_copy = ("""
+COPY staging_songs_raw (num_songs, artist_id, artist_latitude, artist_longitude, artist_location, artist_name, song_id, title, duration, year)
+FROM {}
+credentials 'aws_iam_role={}'
+json 'auto' gzip manifest region 'us-west-2'
+""").format(config['S3'].get('song_manifest', "''"), config['IAM_ROLE']['ARN'])
+
+staging_events_columns = ("artist, auth, firstName, gender, iteminSession, lastName, length, level, location, method, page, registration, "
+                          "sessionId, song, status, ts, userAgent, userId")
+staging_songs_columns = "num_songs, artist_id, artist_latitude, artist_longitude, artist_location, artist_name, song_id, title, duration, year"
+
+# the local inserts fill the raw staging tables from JSON files read by etl.py --local-data, in place of the COPY statements
+staging_events_raw_insert = "INSERT INTO staging_events_raw ({}) VALUES %s".format(staging_events_columns)
+staging_songs_raw_insert = "INSERT INTO staging_songs_raw ({}) VALUES %s".format(staging_songs_columns)
+
+staging_events_key_insert = ("""INSERT INTO staging_events ({columns}, song_key)
+    SELECT {columns}, {song_key}
+    FROM staging_events_raw
+""").format(columns=staging_events_columns, song_key=song_key_expression.format(title="song", artist="artist", duration="length"))
+
+staging_songs_key_insert = ("""INSERT INTO staging_songs ({columns}, song_key)
+    SELECT {columns}, {song_key}
+    FROM staging_songs_raw
+""").format(columns=staging_songs_columns, song_key=song_key_expression.format(title="title", artist="artist_name", duration="duration"))
+
 # FINAL TABLES
 
 # Note:  TIMESTAMP function taken from stackoverflow, https://stackoverflow.com/questions/39815425/how-to-convert-epoch-to-datetime-redshift
 songplay_table_insert = ("""INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
     SELECT DISTINCT 
-        TIMESTAMP 'epoch' + stagingevents.ts/1000 * INTERVAL '1 second' AS start_time
+        TIMESTAMP 'epoch' + se.ts/1000 * INTERVAL '1 second' AS start_time
         , se.userId as user_id
         , se.level
         , ss.song_id
@@ -150,9 +283,7 @@ songplay_table_insert = ("""INSERT INTO songplays (start_time, user_id, level, s
         , se.userAgent as user_agent
     FROM staging_events as se
     JOIN staging_songs as ss
-    ON se.song = ss.title
-    AND se.artist = ss.artist_name
-    AND se.length = ss.duration
+    ON se.song_key = ss.song_key
     """)
 
 user_table_insert = ("""INSERT INTO users (user_id, first_name, last_name, gender, level)
@@ -163,7 +294,7 @@ user_table_insert = ("""INSERT INTO users (user_id, first_name, last_name, gende
         , gender
         , level
     FROM staging_events
-    WHERE page = "NextSong"
+    WHERE page = 'NextSong'
     """)
 
 song_table_insert = ("""INSERT INTO songs (song_id, title, artist_id, year, duration)
@@ -188,21 +319,233 @@ artist_table_insert = ("""INSERT INTO artists (artist_id, name, location, latitu
 
 # Note:  EXTRACT functions syntax taken from AWS documentation, https://docs.aws.amazon.com/redshift/latest/dg/r_EXTRACT_function.html
 # Note:  TIMESTAMP function taken from stackoverflow, https://stackoverflow.com/questions/39815425/how-to-convert-epoch-to-datetime-redshift
+# start_time is worked out in a derived table, as Postgres does not allow a select list alias to be used in the same select list
 time_table_insert = ("""INSERT INTO time (start_time, hour, day, week, month, year, weekday)
-    SELECT DISTINCT
-        TIMESTAMP 'epoch' + stagingevents.ts/1000 * INTERVAL '1 second' AS start_time
+    SELECT
+        start_time
         , extract(hour from start_time) as hour
         , extract(day from start_time) as day
         , extract(week from start_time) as week
         , extract(month from start_time) as month
         , extract(year from start_time) as year
-        , extract(weekday from start_time) as weekday
+        , extract(dow from start_time) as weekday
+    FROM (
+        SELECT DISTINCT TIMESTAMP 'epoch' + ts/1000 * INTERVAL '1 second' AS start_time
+        FROM staging_events
+    ) as event_times
+    """)
+
+# compares the songplays join on song_key with the join on the song title, artist name and length, giving the number of event and song
+# pairs matched by the old join, by the new join, only by the old join and only by the new join.  The last two should be 0.
+songplay_join_validation = ("""
+    WITH old_join AS (
+        SELECT se.ts, se.userId, se.sessionId, se.iteminSession, ss.song_id
+        FROM staging_events as se
+        JOIN staging_songs as ss
+        ON se.song = ss.title
+        AND se.artist = ss.artist_name
+        AND se.length = ss.duration
+    ), new_join AS (
+        SELECT se.ts, se.userId, se.sessionId, se.iteminSession, ss.song_id
+        FROM staging_events as se
+        JOIN staging_songs as ss
+        ON se.song_key = ss.song_key
+    )
+    SELECT
+        (SELECT COUNT(*) FROM old_join) as old_join_rows
+        , (SELECT COUNT(*) FROM new_join) as new_join_rows
+        , (SELECT COUNT(*) FROM (SELECT * FROM old_join EXCEPT SELECT * FROM new_join) as old_only) as old_only_rows
+        , (SELECT COUNT(*) FROM (SELECT * FROM new_join EXCEPT SELECT * FROM old_join) as new_only) as new_only_rows
+    """)
+
+# LOAD HISTORY
+
+load_history_insert = ("""INSERT INTO load_history (run_id, statement, started_at, elapsed_seconds, rows_affected, query_plan, regressed)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """)
+
+# average elapsed time of the statement over its most recent runs before this one
+load_history_previous_select = ("""SELECT AVG(elapsed_seconds), COUNT(*)
+    FROM (
+        SELECT elapsed_seconds
+        FROM load_history
+        WHERE statement = %s
+        AND run_id <> %s
+        ORDER BY started_at DESC
+        LIMIT %s
+    ) as previous_runs
+    """)
+
+# INCREMENTAL LOADS
+
+# The incremental statements are run in a single transaction with the high-water mark of staging_events.ts from the last run bound to
+# %(high_water_mark)s, so that only newer events are loaded into songplays and time.  Dimension rows are replaced by deleting the rows
+# with the natural keys found in staging and inserting the latest version of each, so that changes such as a user's level overwrite the old row.
+# staging_songs holds every song, so songs and artists rows are only deleted when their values have changed and only inserted when missing,
+# which keeps the rows rewritten in line with the changes rather than the size of the song data.
+
+# Before the first incremental run the high-water mark is taken from the latest start_time in the time table, which holds every NextSong
+# event loaded by a full load, so that the first incremental run after a full load does not insert the same events again
+high_water_mark_select = ("""SELECT COALESCE(
+        (SELECT MAX(high_water_mark) FROM load_state WHERE name = 'staging_events')
+        , (SELECT EXTRACT(EPOCH FROM MAX(start_time)) * 1000 FROM time)
+        , 0)
+    """)
+
+high_water_mark_insert = ("""INSERT INTO load_state (name, high_water_mark, loaded_at)
+    SELECT 'staging_events', MAX(ts), %(loaded_at)s
     FROM staging_events
+    WHERE ts > %(high_water_mark)s
+    HAVING COUNT(*) > 0
+    """)
+
+user_table_delete_incremental = ("""DELETE FROM users
+    USING staging_events
+    WHERE users.user_id = staging_events.userId
+    AND staging_events.page = 'NextSong'
+    AND staging_events.ts > %(high_water_mark)s
+    """)
+
+user_table_insert_incremental = ("""INSERT INTO users (user_id, first_name, last_name, gender, level)
+    SELECT user_id, first_name, last_name, gender, level
+    FROM (
+        SELECT
+            userId as user_id
+            , firstName as first_name
+            , lastName as last_name
+            , gender
+            , level
+            , ROW_NUMBER() OVER (PARTITION BY userId ORDER BY ts DESC) as latest
+        FROM staging_events
+        WHERE page = 'NextSong'
+        AND userId IS NOT NULL
+        AND ts > %(high_water_mark)s
+    ) as user_events
+    WHERE latest = 1
+    """)
+
+song_table_delete_incremental = ("""DELETE FROM songs
+    USING staging_songs
+    WHERE songs.song_id = staging_songs.song_id
+    AND (songs.title <> staging_songs.title
+        OR songs.artist_id <> staging_songs.artist_id
+        OR COALESCE(songs.year, -1) <> COALESCE(staging_songs.year, -1)
+        OR songs.duration <> staging_songs.duration)
+    """)
+
+song_table_insert_incremental = ("""INSERT INTO songs (song_id, title, artist_id, year, duration)
+    SELECT song_id, title, artist_id, year, duration
+    FROM (
+        SELECT
+            song_id
+            , title
+            , artist_id
+            , year
+            , duration
+            , ROW_NUMBER() OVER (PARTITION BY song_id ORDER BY title) as latest
+        FROM staging_songs
+        WHERE song_id NOT IN (SELECT song_id FROM songs)
+    ) as song_records
+    WHERE latest = 1
+    """)
+
+artist_table_delete_incremental = ("""DELETE FROM artists
+    USING staging_songs
+    WHERE artists.artist_id = staging_songs.artist_id
+    AND (artists.name <> staging_songs.artist_name
+        OR COALESCE(artists.location, '') <> COALESCE(staging_songs.artist_location, '')
+        OR COALESCE(artists.latitude, 1000) <> COALESCE(staging_songs.artist_latitude, 1000)
+        OR COALESCE(artists.longitude, 1000) <> COALESCE(staging_songs.artist_longitude, 1000))
+    """)
+
+artist_table_insert_incremental = ("""INSERT INTO artists (artist_id, name, location, latitude, longitude)
+    SELECT artist_id, name, location, latitude, longitude
+    FROM (
+        SELECT
+            artist_id
+            , artist_name as name
+            , artist_location as location
+            , artist_latitude as latitude
+            , artist_longitude as longitude
+            , ROW_NUMBER() OVER (PARTITION BY artist_id ORDER BY song_id) as latest
+        FROM staging_songs
+        WHERE artist_id NOT IN (SELECT artist_id FROM artists)
+    ) as artist_records
+    WHERE latest = 1
+    """)
+
+songplay_table_insert_incremental = ("""INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
+    SELECT DISTINCT
+        TIMESTAMP 'epoch' + se.ts/1000 * INTERVAL '1 second' AS start_time
+        , se.userId as user_id
+        , se.level
+        , ss.song_id
+        , ss.artist_id
+        , se.sessionId as session_id
+        , ss.artist_location as location
+        , se.userAgent as user_agent
+    FROM staging_events as se
+    JOIN staging_songs as ss
+    ON se.song_key = ss.song_key
+    WHERE se.page = 'NextSong'
+    AND se.ts > %(high_water_mark)s
+    """)
+
+time_table_insert_incremental = ("""INSERT INTO time (start_time, hour, day, week, month, year, weekday)
+    SELECT
+        start_time
+        , extract(hour from start_time) as hour
+        , extract(day from start_time) as day
+        , extract(week from start_time) as week
+        , extract(month from start_time) as month
+        , extract(year from start_time) as year
+        , extract(dow from start_time) as weekday
+    FROM (
+        SELECT DISTINCT TIMESTAMP 'epoch' + ts/1000 * INTERVAL '1 second' AS start_time
+        FROM staging_events
+        WHERE page = 'NextSong'
+        AND ts > %(high_water_mark)s
+    ) as new_times
     """)
 
 # QUERY LISTS
 
-create_table_queries = [staging_events_table_create, staging_songs_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create]
-drop_table_queries = [staging_events_table_drop, staging_songs_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop]
-copy_table_queries = [staging_events_copy, staging_songs_copy]
+create_table_queries = [staging_events_raw_table_create, staging_songs_raw_table_create, staging_events_table_create, staging_songs_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create, load_state_table_create, load_history_table_create]
+drop_table_queries = [staging_events_raw_table_drop, staging_songs_raw_table_drop, staging_events_table_drop, staging_songs_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop, load_state_table_drop]
+staging_truncate_queries = [staging_events_raw_truncate, staging_songs_raw_truncate, staging_events_truncate, staging_songs_truncate]
+copy_table_queries = [staging_events_copy, staging_songs_copy, staging_events_key_insert, staging_songs_key_insert]
+manifest_copy_table_queries = [staging_events_manifest_copy, staging_songs_manifest_copy, staging_events_key_insert, staging_songs_key_insert]
+manifest_copy_steps = {"staging_events_copy": staging_events_manifest_copy, "staging_songs_copy": staging_songs_manifest_copy}
 insert_table_queries = [songplay_table_insert, user_table_insert, song_table_insert, artist_table_insert, time_table_insert]
+
+incremental_table_queries = [user_table_delete_incremental, user_table_insert_incremental, song_table_delete_incremental, song_table_insert_incremental,
+                             artist_table_delete_incremental, artist_table_insert_incremental, songplay_table_insert_incremental, time_table_insert_incremental]
+
+# statements of the load with the statements each one depends on, the scheduler in etl.py runs statements that do not depend on each other at the same time
+load_steps = {
+    "staging_events_copy": (staging_events_copy, []),
+    "staging_songs_copy": (staging_songs_copy, []),
+    "staging_events_key": (staging_events_key_insert, ["staging_events_copy"]),
+    "staging_songs_key": (staging_songs_key_insert, ["staging_songs_copy"]),
+    "songplays": (songplay_table_insert, ["staging_events_key", "staging_songs_key"]),
+    "users": (user_table_insert, ["staging_events_key"]),
+    "songs": (song_table_insert, ["staging_songs_key"]),
+    "artists": (artist_table_insert, ["staging_songs_key"]),
+    "time": (time_table_insert, ["staging_events_key"]),
+}
+
+# name each statement is recorded under in load_history by load_profiler.py, the load_steps names for the statements of the full load, so
+# that the full and incremental inserts into the same table are timed separately
+statement_names = {query: name for name, (query, dependencies) in load_steps.items()}
+statement_names.update({
+    staging_events_manifest_copy: "staging_events_manifest_copy",
+    staging_songs_manifest_copy: "staging_songs_manifest_copy",
+    user_table_delete_incremental: "users_delete_incremental",
+    user_table_insert_incremental: "users_incremental",
+    song_table_delete_incremental: "songs_delete_incremental",
+    song_table_insert_incremental: "songs_incremental",
+    artist_table_delete_incremental: "artists_delete_incremental",
+    artist_table_insert_incremental: "artists_incremental",
+    songplay_table_insert_incremental: "songplays_incremental",
+    time_table_insert_incremental: "time_incremental",
+})
@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import subprocess
+import contextlib
+import importlib.util
+from datetime import datetime
+from pyspark import StorageLevel
+from pyspark.java_gateway import ensure_callback_server_started
+import etl
+from layout import partition_files
+
+# the synthetic data is written by the generator of Project2's generate_data.py, imported from its file, so that both projects are
+# benchmarked on the same data for a given scale and seed
+GENERATOR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Project2-Data-Modelling-with-Postgres", "generate_data.py")
+generator_spec = importlib.util.spec_from_file_location("generate_data", GENERATOR_PATH)
+generate_data = importlib.util.module_from_spec(generator_spec)
+generator_spec.loader.exec_module(generate_data)
+
+TABLES = ["song_table", "artist_table", "users_table", "time_table", "songplays_table"]
+
+class StageMetricsListener:
+    """
+    Spark listener, implemented in python through the py4j callback server, that collects the metrics of every stage and task of the ETL.
+
+    - Each stage is recorded under the ETL step that was running when it completed, set through the step attribute
+    - Stage metrics are the totals over the tasks of the stage, task metrics are kept for each task so that skew between the tasks of a stage can be seen
+    - Events the listener has no method for are ignored
+    """
+
+    def __init__(self):
+        self.step = None
+        self.stages = []
+        self.tasks = {}
+
+    def onTaskEnd(self, task_end):
+        metrics = task_end.taskMetrics()
+        if metrics is None:
+            return
+        self.tasks.setdefault((task_end.stageId(), task_end.stageAttemptId()), []).append({
+            "task_id": task_end.taskInfo().taskId(),
+            "seconds": task_end.taskInfo().duration() / 1000,
+            "run_ms": metrics.executorRunTime(),
+            "gc_ms": metrics.jvmGCTime(),
+            "input_bytes": metrics.inputMetrics().bytesRead(),
+            "shuffle_read_bytes": metrics.shuffleReadMetrics().totalBytesRead(),
+            "shuffle_write_bytes": metrics.shuffleWriteMetrics().bytesWritten(),
+            "spilled_bytes": metrics.memoryBytesSpilled() + metrics.diskBytesSpilled(),
+            "output_bytes": metrics.outputMetrics().bytesWritten(),
+        })
+
+    def onStageCompleted(self, stage_completed):
+        info = stage_completed.stageInfo()
+        metrics = info.taskMetrics()
+        submitted, completed = info.submissionTime(), info.completionTime()
+        self.stages.append({
+            "step": self.step,
+            "stage_id": info.stageId(),
+            "name": info.name(),
+            "num_tasks": info.numTasks(),
+            "seconds": (completed.get() - submitted.get()) / 1000 if submitted.isDefined() and completed.isDefined() else None,
+            "input_bytes": metrics.inputMetrics().bytesRead(),
+            "input_records": metrics.inputMetrics().recordsRead(),
+            "shuffle_read_bytes": metrics.shuffleReadMetrics().totalBytesRead(),
+            "shuffle_write_bytes": metrics.shuffleWriteMetrics().bytesWritten(),
+            "memory_spilled_bytes": metrics.memoryBytesSpilled(),
+            "disk_spilled_bytes": metrics.diskBytesSpilled(),
+            "gc_ms": metrics.jvmGCTime(),
+            "run_ms": metrics.executorRunTime(),
+            "output_bytes": metrics.outputMetrics().bytesWritten(),
+            "output_records": metrics.outputMetrics().recordsWritten(),
+            "tasks": self.tasks.pop((info.stageId(), info.attemptNumber()), []),
+        })
+
+    def __getattr__(self, name):
+        if name.startswith("on"):
+            return lambda event: None
+        raise AttributeError(name)
+
+    class Java:
+        implements = ["org.apache.spark.scheduler.SparkListenerInterface"]
+
+def wait_for_listeners(spark):
+    """
+    - Waits until the Spark listener bus has delivered every event so far, as listeners are called on a thread of their own
+    """
+    spark.sparkContext._jsc.sc().listenerBus().waitUntilEmpty()
+
+def step_totals(stages, step):
+    """
+    - Returns the totals of the stage metrics of one ETL step
+    """
+    step_stages = [stage for stage in stages if stage["step"] == step]
+    totals = {"stages": len(step_stages), "tasks": sum(stage["num_tasks"] for stage in step_stages)}
+    for key in ["input_bytes", "shuffle_read_bytes", "shuffle_write_bytes", "memory_spilled_bytes", "disk_spilled_bytes", "gc_ms", "output_bytes"]:
+        totals[key] = sum(stage[key] for stage in step_stages)
+    return totals
+
+def run_scale(spark, listener, data, output, args):
+    """
+    - Runs the ETL steps on the data folder in the Spark session, writing the tables to the output folder, which is removed first
+    - Returns the wall time and stage metric totals of each step, the stages with their task metrics and the number of files and partitions of each table written
+    """
+    shutil.rmtree(output, ignore_errors=True)
+    storage_level = getattr(StorageLevel, args.storage_level)
+    input_data = data.rstrip("/") + "/"
+    output_data = output.rstrip("/") + "/"
+    listener.stages = []
+
+    df_song = None
+    steps = [
+        ("read_song_data", lambda: etl.read_song_data(spark, input_data, storage_level)),
+        ("process_song_data", lambda: etl.process_song_data(spark, df_song, output_data, args.target_file_mb, args.songs_buckets)),
+        ("process_log_data", lambda: etl.process_log_data(spark, input_data, output_data, df_song, args.broadcast_mb, storage_level,
+                                                          target_mb=args.target_file_mb)),
+    ]
+    timings = []
+    for step, func in steps:
+        listener.step = step
+        start = time.perf_counter()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            result = func()
+        elapsed = time.perf_counter() - start
+        if step == "read_song_data":
+            df_song = result
+        wait_for_listeners(spark)
+        timings.append(dict(step=step, seconds=round(elapsed, 3), **step_totals(listener.stages, step)))
+    df_song.unpersist()
+    spark.catalog.clearCache()
+
+    tables = {}
+    for table in TABLES:
+        partitions = partition_files(spark, output_data + table + ".parquet")
+        tables[table] = {"partitions": len(partitions), "files": sum(len(files) for files in partitions.values()),
+                         "bytes": sum(size for files in partitions.values() for file_path, size in files)}
+    return timings, listener.stages, tables
+
+def git_commit():
+    """
+    - Returns the git commit the benchmark is run on, or None outside a git repository
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    """
+    - Generates the synthetic data for each scale factor with Project2's generate_data.py, unless it is already in --data-dir, where `generate_data.py --output` of Project2 can also write it
+    - Runs the ETL steps on each scale in Spark local mode, with a listener collecting the metrics of every stage and task
+    - Prints the wall time, input, shuffle, spill and GC of each step and the files written for each table
+    - Appends the results, with the git commit and ETL options of the run, to the JSON file given by --output so that commits and options can be compared
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the data lake ETL on synthetic data in Spark local mode")
+    parser.add_argument("--scale", type=int, nargs="+", default=[1, 10], help="scale factors to run, for example 1 10 100")
+    parser.add_argument("--data-dir", default="generated_data", help="directory holding the scale_<n> data folders")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file the results are appended to")
+    parser.add_argument("--storage-level", default="MEMORY_AND_DISK", help="pyspark StorageLevel the song and log data are persisted with")
+    parser.add_argument("--broadcast-mb", type=float, default=64, help="the song data is broadcast in the songplays join when it is smaller than this, in MB")
+    parser.add_argument("--target-file-mb", type=float, default=128, help="size of the parquet files written, in MB")
+    parser.add_argument("--songs-buckets", type=int, default=0, help="partition the songs table by year and bucket it by artist_id into this number of buckets")
+    args = parser.parse_args()
+
+    spark = etl.create_spark_session(local=True)
+    ensure_callback_server_started(spark.sparkContext._gateway)
+    listener = StageMetricsListener()
+    spark.sparkContext._jsc.sc().addSparkListener(listener)
+
+    run = {"started_at": datetime.now().isoformat(timespec="seconds"), "commit": git_commit(), "spark_version": spark.version,
+           "options": {key: value for key, value in vars(args).items() if key not in ("scale", "data_dir", "output")}, "results": []}
+    try:
+        for scale in args.scale:
+            data = os.path.join(args.data_dir, "scale_{}".format(scale))
+            if not os.path.isdir(data):
+                num_songs, num_events = generate_data.generate(data, scale)
+                print('{} song files and {} log events written to {}'.format(num_songs, num_events, data))
+
+            timings, stages, tables = run_scale(spark, listener, data, os.path.join(data, "output"), args)
+            run["results"].append({"scale": scale, "steps": timings, "tables": tables, "stages": stages})
+            for timing in timings:
+                print('scale {:>5} {:<18}{:>9.3f}s{:>5} stages{:>6} tasks  input {:>12}  shuffle {:>12}  spill {:>10}  gc {:>6} ms'.format(
+                    scale, timing["step"], timing["seconds"], timing["stages"], timing["tasks"], timing["input_bytes"],
+                    timing["shuffle_read_bytes"] + timing["shuffle_write_bytes"], timing["memory_spilled_bytes"] + timing["disk_spilled_bytes"], timing["gc_ms"]))
+            print('scale {:>5} files written: {}'.format(scale, ", ".join("{} {}".format(table, counts["files"]) for table, counts in tables.items())))
+    finally:
+        spark.sparkContext._jsc.sc().removeSparkListener(listener)
+        spark.stop()
+
+    history = []
+    if os.path.exists(args.output):
+        with open(args.output) as f:
+            history = json.load(f)
+    history.append(run)
+    with open(args.output, "w") as f:
+        json.dump(history, f, indent=2)
+    print('results written to {}'.format(args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# import packages
+import re
+import math
+import argparse
+from etl import create_spark_session
+from layout import partition_files, compact_partition
+
+# bucketed files end in the bucket number, for example part-00000-<uuid>_00003.c000.snappy.parquet, and must keep one file per bucket
+BUCKET_FILE = re.compile(r"_\d{5}\.c\d{3}")
+
+def needs_compaction(files, target_mb):
+    """
+    - Returns True if the partition holds more files than it needs for files of about target_mb each
+    """
+    size_mb = sum(size for file_path, size in files) / 1024 / 1024
+    return len(files) > max(1, math.ceil(size_mb / target_mb))
+
+
+def main():
+    """
+    - Offline compaction of the parquet tables written by etl.py, run while the ETL is not writing to them
+    - Every partition folder of each --tables table that holds more files than needed for files of about --target-mb each is rewritten in place
+    - Partitions of bucketed tables are left as they are, as their files are one per bucket
+    """
+    parser = argparse.ArgumentParser(description="Compact the small parquet files of the data lake tables")
+    parser.add_argument("--local", action="store_true", help="run in Spark local mode on a local output folder")
+    parser.add_argument("--output-data", help="location the tables were written to, s3a://dc-data-lake/ or output/ with --local")
+    parser.add_argument("--tables", nargs="+", default=["song_table", "artist_table", "users_table", "time_table", "songplays_table"], help="tables to compact")
+    parser.add_argument("--target-mb", type=float, default=128, help="size of each compacted file, in MB")
+    args = parser.parse_args()
+
+    output_data = args.output_data or ("output/" if args.local else "s3a://dc-data-lake/")
+    spark = create_spark_session(args.local)
+
+    for table in args.tables:
+        partitions = partition_files(spark, output_data + table + ".parquet")
+        num_before = sum(len(files) for files in partitions.values())
+        num_after = num_before
+        for partition_path, files in sorted(partitions.items()):
+            if needs_compaction(files, args.target_mb) and not any(BUCKET_FILE.search(file_path) for file_path, size in files):
+                num_after += compact_partition(spark, partition_path, files, args.target_mb) - len(files)
+        print("{:<20}{:>8} partitions{:>8} files before{:>8} files after".format(table, len(partitions), num_before, num_after))
+
+
+if __name__ == "__main__":
+    main()
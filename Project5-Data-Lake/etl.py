@@ -3,42 +3,193 @@ import pandas as pd
 import configparser
 from datetime import datetime
 import os
+import re
+import json
+import argparse
+from zipfile import ZipFile
+from pyspark import StorageLevel
 from pyspark.sql import SparkSession
-from pyspark.sql.functions import udf, col
+from pyspark.sql.functions import udf, col, input_file_name
 from pyspark.sql.functions import year, month, dayofmonth, hour, weekofyear, date_format, to_date
-from pyspark.sql.types import IntegerType, StringType, TimestampType, DateType
+from pyspark.sql.types import IntegerType, StringType, TimestampType, DateType, StructType, StructField
+from schemas import song_schema, log_schema, corrupt_record_column
+from layout import estimated_size_mb, write_table
 
 # configure session
 config = configparser.ConfigParser()
 config.read('dl.cfg')
 
 # configure AWS connection
-os.environ['AWS_ACCESS_KEY_ID']=['AWS']['AWS_ACCESS_KEY_ID']
-os.environ['AWS_SECRET_ACCESS_KEY']=['AWS']['AWS_SECRET_ACCESS_KEY']
+os.environ['AWS_ACCESS_KEY_ID']=config['AWS']['AWS_ACCESS_KEY_ID']
+os.environ['AWS_SECRET_ACCESS_KEY']=config['AWS']['AWS_SECRET_ACCESS_KEY']
 
 # configure session
-def create_spark_session():
+def create_spark_session(local=False):
     """
     Configure and build SparkSession
+    - In local mode the session runs on all cores of this machine and reads local files, so the S3 connector is not loaded
     """
+    if local:
+        return SparkSession.builder.master("local[*]").getOrCreate()
     spark = SparkSession \
         .builder \
         .config("spark.jars.packages", "org.apache.hadoop:hadoop-aws:2.7.0") \
         .getOrCreate()
     return spark
 
-def process_song_data(spark, input_data, output_data):
+def unzip_data(data_dir="data"):
     """
-    - Read data from song data files
-    - Select columns required for songs and artists tables
-    - Write songs and artists tables to parquet files
+    - Extracts the smaller song and log datasets bundled in the data folder, song-data.zip to data/song_data and log-data.zip to data/log_data
+    """
+    with ZipFile(os.path.join(data_dir, "song-data.zip"), 'r') as zipObj:
+        zipObj.extractall(data_dir)
+    with ZipFile(os.path.join(data_dir, "log-data.zip"), 'r') as zipObj:
+        zipObj.extractall(os.path.join(data_dir, "log_data"))
+
+def read_json(spark, path, schema, name, mode="PERMISSIVE", quarantine_data=None, strict=False, storage_level=StorageLevel.MEMORY_AND_DISK, recursive=False):
+    """
+    - Read JSON files with the given schema, so Spark does not first read every file to infer it, and persist the records with the storage level
+    - mode is the Spark mode for records that do not match the schema.  FAILFAST stops the job at the first one and DROPMALFORMED drops them
+    - In PERMISSIVE mode they are kept in a corrupt record column and counted.  They are written with the file they came from to quarantine_data/<name> as JSON, then the job fails if strict is set or prints the count and carries on without them
+    - Returns the records that match the schema, persisted
+    """
+    reader = spark.read.schema(schema).option("mode", mode)
+    if mode == "PERMISSIVE":
+        reader = spark.read.schema(StructType(schema.fields + [StructField(corrupt_record_column, StringType())])) \
+            .option("mode", mode).option("columnNameOfCorruptRecord", corrupt_record_column)
+    if recursive:
+        reader = reader.option("recursiveFileLookup", "true").option("pathGlobFilter", "*.json")
+
+    if mode != "PERMISSIVE":
+        return reader.json(path).persist(storage_level)
+
+    # Spark only allows the corrupt record column to be queried on its own once the records are cached
+    df = reader.json(path).withColumn("input_file", input_file_name()).persist(storage_level)
+    df_corrupt = df.filter(df[corrupt_record_column].isNotNull())
+    num_corrupt = df_corrupt.count()
+    if num_corrupt:
+        quarantine_path = (quarantine_data or "quarantine/") + name
+        df_corrupt.select("input_file", corrupt_record_column).write.mode("append").json(quarantine_path)
+        message = "{} {} records do not match the schema, written to {}".format(num_corrupt, name, quarantine_path)
+        if strict:
+            df.unpersist()
+            raise ValueError(message)
+        print(message)
+
+    # keep the matching records in the cache in place of all the records read
+    df_valid = df.filter(df[corrupt_record_column].isNull()).drop(corrupt_record_column, "input_file").persist(storage_level)
+    df_valid.count()
+    df.unpersist()
+    return df_valid
+
+def read_song_data(spark, input_data, storage_level=StorageLevel.MEMORY_AND_DISK, mode="PERMISSIVE", quarantine_data=None, strict=False):
+    """
+    - Read data from song data files once, for the songs and artists tables and the songplays join
+    - Persist the song data with the storage level and count it, so the files are read a single time and the later stages are served from the cache
+    - Records that do not match the song schema are handled by read_json according to mode, quarantine_data and strict
     """
     # get filepath to song data file
     song_data = input_data + "song_data/*/*/*/*.json"
-    
+
     # read song data file
-    df_song = spark.read.json(song_data)
-    
+    df_song = read_json(spark, song_data, song_schema, "song_data", mode, quarantine_data, strict, storage_level)
+    df_song.count()
+    return df_song
+
+def path_exists(spark, path):
+    """
+    - Returns True if the local or S3 path exists, using the Hadoop file system of the Spark session
+    """
+    hadoop_path = spark._jvm.org.apache.hadoop.fs.Path(path)
+    return hadoop_path.getFileSystem(spark._jsc.hadoopConfiguration()).exists(hadoop_path)
+
+def list_log_files(spark, log_data):
+    """
+    - Returns the path of every JSON file under the log data folder, in sorted order
+    """
+    hadoop_path = spark._jvm.org.apache.hadoop.fs.Path(log_data)
+    files = hadoop_path.getFileSystem(spark._jsc.hadoopConfiguration()).listFiles(hadoop_path, True)
+    log_files = []
+    while files.hasNext():
+        path = files.next().getPath().toString()
+        if path.endswith(".json"):
+            log_files.append(path)
+    return sorted(log_files)
+
+def log_date(path):
+    """
+    - Returns the date of a log file from its name, for example 2018-11-01 for 2018-11-01-events.json, or the file name if it does not start with a date
+    """
+    file_name = path.rsplit("/", 1)[-1]
+    match = re.match(r"(\d{4}-\d{2}-\d{2})", file_name)
+    return match.group(1) if match else file_name
+
+def read_checkpoint(checkpoint_file):
+    """
+    - Returns the set of log dates already processed by incremental runs, empty if the checkpoint file does not exist
+    """
+    if not os.path.exists(checkpoint_file):
+        return set()
+    with open(checkpoint_file) as f:
+        return set(json.load(f)["log_dates"])
+
+def write_checkpoint(checkpoint_file, log_dates):
+    """
+    - Writes the processed log dates to the checkpoint file, replacing it in one step so an interrupted write leaves the previous checkpoint in place
+    """
+    with open(checkpoint_file + ".tmp", "w") as f:
+        json.dump({"log_dates": sorted(log_dates), "updated_at": datetime.now().isoformat()}, f, indent=2)
+    os.replace(checkpoint_file + ".tmp", checkpoint_file)
+
+def write_partitions(spark, df, path, partition_cols, incremental=False, target_mb=128, buckets=0, bucket_col=None):
+    """
+    - Write the dataframe to parquet files partitioned by partition_cols, in files of about target_mb each, or bucketed by bucket_col with buckets
+    - In incremental mode only the partitions that the dataframe has rows for are replaced, using dynamic partition overwrite.  The rows already in those partitions are read first and kept, so a partition holding a month of data can be topped up with a new day
+    """
+    if not incremental or not path_exists(spark, path):
+        write_table(spark, df, path, partition_cols, target_mb, buckets=buckets, bucket_col=bucket_col)
+        return
+
+    df_existing = spark.read.schema(df.schema).parquet(path).join(df.select(*partition_cols).distinct(), partition_cols, "left_semi")
+    # the merged rows are checkpointed so that Spark does not read the partitions it is overwriting
+    df_merged = df_existing.unionByName(df).dropDuplicates().localCheckpoint()
+    write_table(spark, df_merged, path, partition_cols, target_mb, dynamic=True, buckets=buckets, bucket_col=bucket_col)
+
+def merge_table(spark, df, path, key, target_mb=128):
+    """
+    - Merge the rows into the unpartitioned table at path, with a new row replacing the row already held with the same key, so the users table keeps the latest level of each user
+    """
+    if path_exists(spark, path):
+        df_existing = spark.read.schema(df.schema).parquet(path).join(df.select(key), key, "left_anti")
+        # the merged rows are checkpointed so that Spark does not read the files it is overwriting
+        df = df_existing.unionByName(df).localCheckpoint()
+    write_table(spark, df, path, target_mb=target_mb)
+
+def insert_new_rows(spark, df, path, key, partition_cols=(), target_mb=128, buckets=0, bucket_col=None):
+    """
+    - Add the rows whose key is not yet in the table at path, keeping the rows already held, so the songs and artists tables keep the songs and artists of earlier runs
+    - Nothing is written when there are no new keys.  Otherwise only the new rows are written, into the partitions they belong to by write_partitions, or appended to an unpartitioned table
+    """
+    if not path_exists(spark, path):
+        write_table(spark, df, path, partition_cols, target_mb, buckets=buckets, bucket_col=bucket_col)
+        return
+
+    df_new = df.join(spark.read.parquet(path).select(key), key, "left_anti").localCheckpoint()
+    if df_new.isEmpty():
+        print("no new rows for {}".format(path))
+        return
+    if partition_cols:
+        write_partitions(spark, df_new, path, partition_cols, True, target_mb, buckets, bucket_col)
+    else:
+        write_table(spark, df_new, path, target_mb=target_mb, append=True)
+
+def process_song_data(spark, df_song, output_data, target_mb=128, songs_buckets=0, incremental=False):
+    """
+    - Select columns required for songs and artists tables from the song data read by read_song_data
+    - Write songs and artists tables to parquet files of about target_mb each
+    - The songs table is partitioned by year and artist, or with songs_buckets by year alone with each year split into that number of buckets by artist, which writes far fewer files
+    - In incremental mode only the songs and artists not already in their tables are written, by insert_new_rows, so that songs added to the song data since the last run are in the songs table the songplays join is checked against
+    """
     # create view of song_data dataframe from which we will extract the required columns
     df_song.createOrReplaceTempView("df_song_data")
 
@@ -53,8 +204,15 @@ def process_song_data(spark, input_data, output_data):
     FROM df_song_data
     """)
     
-    # write songs table to parquet files partitioned by year and artist
-    song_table.write.mode("overwrite").partitionBy("year", "artist_id").parquet(output_data + "song_table.parquet")
+    # write songs table to parquet files partitioned by year and artist, or by year and bucketed by artist, adding only the new songs in incremental mode
+    if songs_buckets:
+        layout = dict(partition_cols=["year"], buckets=songs_buckets, bucket_col="artist_id")
+    else:
+        layout = dict(partition_cols=["year", "artist_id"])
+    if incremental:
+        insert_new_rows(spark, songs_table, output_data + "song_table.parquet", "song_id", target_mb=target_mb, **layout)
+    else:
+        write_table(spark, songs_table, output_data + "song_table.parquet", target_mb=target_mb, **layout)
     
     # extract columns to create artists table
     artists_table = spark.sql("""
@@ -67,43 +225,31 @@ def process_song_data(spark, input_data, output_data):
     FROM df_song_data
     """)
     
-    # write artists table to parquet files
-    artists_table.write.mode("overwrite").parquet(output_data + "artist_table.parquet")
+    # write artists table to parquet files, adding only the new artists in incremental mode
+    if incremental:
+        insert_new_rows(spark, artists_table, output_data + "artist_table.parquet", "artist_id", target_mb=target_mb)
+    else:
+        write_table(spark, artists_table, output_data + "artist_table.parquet", target_mb=target_mb)
 
-def process_log_data(spark, input_data, output_data):
+def process_log_data(spark, input_data, output_data, df_song, broadcast_mb=64, storage_level=StorageLevel.MEMORY_AND_DISK, mode="PERMISSIVE", quarantine_data=None, strict=False, log_files=None, incremental=False, target_mb=128):
     """
-    - Read data from log data files
-    - Select columns required for songs and artists tables
-    - Write songs and artists tables to parquet files
+    - Read data from log data files, or only the log_files given, keeping the song play events
+    - Select columns required for users and time tables and write them to parquet files
+    - Join the song plays to the song data read by read_song_data to create the songplays table and write it to parquet files
+    - The song side of the join is broadcast to every executor when its estimated size is below broadcast_mb, which avoids shuffling the log data
+    - The log data is persisted with the storage level as it feeds the users, time and songplays tables
+    - Records that do not match the log schema are handled by read_json according to mode, quarantine_data and strict
+    - The tables are written in parquet files of about target_mb each
+    - In incremental mode the users are merged into the users table and only the year and month partitions of the time and songplays tables that the log files have events for are replaced
     """
-    # get filepath to log data file
-    log_data = "log_data/*.json"
+    # get filepath to log data file, log files are held by year and month on S3 and in a single folder locally
+    log_data = input_data + "log_data"
 
     # read log data file
-    df_log = spark.read.json(log_data)
+    df_events = read_json(spark, log_files or log_data, log_schema, "log_data", mode, quarantine_data, strict, storage_level, recursive=log_files is None)
     
     # filter by actions for song plays
-    df_log = df_log.filter(df_log["page"] == "NextSong")
-
-    # Create view of df_log from which to access the columns
-    df_log.createOrReplaceTempView("df_log_data")
-
-    # extract columns for users table
-    users_table = spark.sql("""
-    SELECT DISTINCT 
-        userId as user_id
-        , firstName as first_name
-        , lastName as last_name
-        , gender
-        , level
-    FROM df_log_data
-    """)
-    
-    #user_id is a string but could be an integer, update the datatype to integer
-    users_table = users_table.withColumn("user_id", users_table["user_id"].cast(IntegerType()))
-
-    # write users table to parquet files
-    users_table.write.mode("overwrite").parquet(output_data + "users_table.parquet")
+    df_log = df_events.filter(df_events["page"] == "NextSong")
 
     # create timestamp column from original timestamp column
     # get_timestamp = udf()
@@ -115,6 +261,37 @@ def process_log_data(spark, input_data, output_data):
     
     # Create view of df_datetime from which to access the columns
     df_datetime.createOrReplaceTempView("df_datetime_data")
+
+    # extract columns for users table, taking the latest event of each user so the table holds their current level
+    users_table = spark.sql("""
+    SELECT
+        user_id
+        , first_name
+        , last_name
+        , gender
+        , level
+    FROM (
+        SELECT
+            userId as user_id
+            , firstName as first_name
+            , lastName as last_name
+            , gender
+            , level
+            , ROW_NUMBER() OVER (PARTITION BY userId ORDER BY ts DESC) as event_rank
+        FROM df_datetime_data
+    )
+    WHERE event_rank = 1
+    """)
+    
+    #user_id is a string but could be an integer, update the datatype to integer
+    users_table = users_table.withColumn("user_id", users_table["user_id"].cast(IntegerType()))
+
+    # write users table to parquet files, merged with the users already held in incremental mode
+    if incremental:
+        merge_table(spark, users_table, output_data + "users_table.parquet", "user_id", target_mb=target_mb)
+    else:
+        write_table(spark, users_table, output_data + "users_table.parquet", target_mb=target_mb)
+
     # extract columns to create time table
     time_table = spark.sql("""
     SELECT DISTINCT
@@ -129,20 +306,15 @@ def process_log_data(spark, input_data, output_data):
     """)
     
     # write time table to parquet files partitioned by year and month
-    time_table.write.mode("overwrite").partitionBy("year","month").parquet(output_data + "time_table.parquet")
+    write_partitions(spark, time_table, output_data + "time_table.parquet", ["year", "month"], incremental, target_mb)
 
-    # get filepath to song data file
-    song_data = "data/song-data.zip"
-    
-    # read in song data to use for songplays table
-    df_song = spark.read.json(song_data)
-
-    # create view of song_data dataframe from which we will extract the required columns
+    # create view of the song data read once by read_song_data, broadcast when it is small enough
     df_song.createOrReplaceTempView("df_song_data")
+    song_hint = "/*+ BROADCAST(s) */" if estimated_size_mb(df_song) < broadcast_mb else ""
 
     # extract columns from joined song and log datasets to create songplays table 
     songplays_table = spark.sql("""
-    SELECT DISTINCT 
+    SELECT {} DISTINCT
         d.timestamp AS start_time
         , d.userId as user_id
         , d.level
@@ -151,27 +323,74 @@ def process_log_data(spark, input_data, output_data):
         , d.sessionId as session_id
         , s.artist_location as location
         , d.userAgent as user_agent
+        , extract(year from d.timestamp) as year
+        , extract(month from d.timestamp) as month
     FROM df_datetime_data as d
     JOIN df_song_data as s
     ON d.song = s.title
     AND d.artist = s.artist_name
     AND d.length = s.duration
-    """)
+    """.format(song_hint))
 
     #user_id is a string but could be an integer, update the datatype to integer
     songplays_table = songplays_table.withColumn("user_id", songplays_table["user_id"].cast(IntegerType()))
 
-    # write songplays table to parquet files (partitioned by artist_id)
-    songplays_table.write.mode("overwrite").partitionBy("artist_id").parquet(output_data + "songplays_table.parquet")
+    # write songplays table to parquet files partitioned by year and month
+    write_partitions(spark, songplays_table, output_data + "songplays_table.parquet", ["year", "month"], incremental, target_mb)
+
+    df_events.unpersist()
 
 
 def main():
-    spark = create_spark_session()
-    input_data = "s3a://udacity-dend/"
-    output_data = "s3a://dc-data-lake/"
-    
-    process_song_data(spark, input_data, output_data)    
-    process_log_data(spark, input_data, output_data)
+    """
+    - Reads the song data once and builds the songs, artists, users, time and songplays tables from it and the log data
+    - With --local the session runs in Spark local mode on the smaller datasets in the data folder, which are extracted first, and writes to a local output folder
+    - --storage-level sets how the song data and log data are persisted and --broadcast-mb the size below which the song data is broadcast in the songplays join
+    - The song and log data are read with the schemas in schemas.py.  --mode sets how records that do not match them are handled, in PERMISSIVE mode they are written to --quarantine-data and with --strict the run then fails
+    - Each table is repartitioned by its partition columns before it is written, in files of about --target-file-mb each.  With --songs-buckets the songs table is partitioned by year and bucketed by artist instead of partitioned by year and artist
+    - With --incremental only the log files of dates not yet in the --checkpoint file are read.  The users are merged and the year and month partitions they have events for are replaced in the time and songplays tables.  Only the songs and artists not already held are added to their tables, so that songs added since the last run are kept alongside the earlier ones
+    """
+    parser = argparse.ArgumentParser(description="Build the sparkify data lake tables with Spark")
+    parser.add_argument("--local", action="store_true", help="run in Spark local mode on the datasets in the data folder")
+    parser.add_argument("--input-data", help="location of the song_data and log_data folders, s3a://udacity-dend/ or data/ with --local")
+    parser.add_argument("--output-data", help="location the parquet tables are written to, s3a://dc-data-lake/ or output/ with --local")
+    parser.add_argument("--storage-level", default="MEMORY_AND_DISK", help="pyspark StorageLevel the song data and song play events are persisted with")
+    parser.add_argument("--broadcast-mb", type=float, default=64, help="the song data is broadcast in the songplays join when it is smaller than this, in MB")
+    parser.add_argument("--mode", default="PERMISSIVE", choices=["PERMISSIVE", "DROPMALFORMED", "FAILFAST"], help="how records that do not match the song and log schemas are handled")
+    parser.add_argument("--quarantine-data", help="location records that do not match the schemas are written to in PERMISSIVE mode, <output-data>quarantine/ by default")
+    parser.add_argument("--strict", action="store_true", help="fail the run if any record does not match the schemas, after writing them to --quarantine-data")
+    parser.add_argument("--target-file-mb", type=float, default=128, help="size of the parquet files written, in MB")
+    parser.add_argument("--songs-buckets", type=int, default=0, help="partition the songs table by year and bucket it by artist_id into this number of buckets, rather than partition it by year and artist_id")
+    parser.add_argument("--incremental", action="store_true", help="only process log files of dates not yet processed and update the tables in place")
+    parser.add_argument("--checkpoint", default="etl_checkpoint.json", help="local file holding the log dates processed by incremental runs")
+    args = parser.parse_args()
+
+    if args.local:
+        unzip_data("data")
+    input_data = args.input_data or ("data/" if args.local else "s3a://udacity-dend/")
+    output_data = args.output_data or ("output/" if args.local else "s3a://dc-data-lake/")
+    quarantine_data = args.quarantine_data or output_data + "quarantine/"
+    storage_level = getattr(StorageLevel, args.storage_level)
+
+    spark = create_spark_session(args.local)
+
+    log_files = None
+    if args.incremental:
+        processed_dates = read_checkpoint(args.checkpoint)
+        log_files = [path for path in list_log_files(spark, input_data + "log_data") if log_date(path) not in processed_dates]
+        new_dates = set(log_date(path) for path in log_files)
+        print("{} new log dates to process: {}".format(len(new_dates), ", ".join(sorted(new_dates))))
+        if not log_files:
+            return
+
+    df_song = read_song_data(spark, input_data, storage_level, args.mode, quarantine_data, args.strict)
+    process_song_data(spark, df_song, output_data, args.target_file_mb, args.songs_buckets, args.incremental)
+    process_log_data(spark, input_data, output_data, df_song, args.broadcast_mb, storage_level, args.mode, quarantine_data, args.strict,
+                     log_files, args.incremental, args.target_file_mb)
+    df_song.unpersist()
+
+    if args.incremental:
+        write_checkpoint(args.checkpoint, processed_dates | new_dates)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,144 @@
+# output layout of the data lake tables, so that each table is written as a few files of about a target size rather than many small ones
+import math
+from pyspark import StorageLevel
+
+def estimated_size_mb(df):
+    """
+    - Returns the size of the dataframe estimated by the Spark optimizer, in MB.  This is worked out from the size of the input files and the width of the columns kept, not from the rows themselves, so for rows read from JSON it is several times their size once written as compressed parquet
+    """
+    return int(df._jdf.queryExecution().optimizedPlan().stats().sizeInBytes()) / 1024 / 1024
+
+def delete_path(spark, path):
+    """
+    - Deletes the local or S3 path and everything under it, using the Hadoop file system of the Spark session
+    """
+    hadoop_path = spark._jvm.org.apache.hadoop.fs.Path(path)
+    hadoop_path.getFileSystem(spark._jsc.hadoopConfiguration()).delete(hadoop_path, True)
+
+def qualified_path(spark, path):
+    """
+    - Returns the full url of the local or S3 path, as paths given to the session catalog are otherwise taken to be under its warehouse folder
+    """
+    hadoop_path = spark._jvm.org.apache.hadoop.fs.Path(path)
+    return hadoop_path.getFileSystem(spark._jsc.hadoopConfiguration()).makeQualified(hadoop_path).toString()
+
+def parquet_size_mb(spark, df, num_rows, path, sample_rows=100000):
+    """
+    - Returns the size the rows of the dataframe take up as parquet files, in MB
+    - Up to sample_rows rows are written as one parquet file to a _sample folder next to path, and its size is scaled up by the number of rows.  The optimizer estimate of estimated_size_mb is worked out from the input files and column widths, which for rows read from JSON is about 10 times their parquet size
+    """
+    if not num_rows:
+        return 0
+    sample_path = path.rstrip("/") + "_sample"
+    df.limit(sample_rows).coalesce(1).write.mode("overwrite").parquet(sample_path)
+    sample_bytes = sum(size for files in partition_files(spark, sample_path).values() for file_path, size in files)
+    delete_path(spark, sample_path)
+    return sample_bytes * num_rows / min(num_rows, sample_rows) / 1024 / 1024
+
+def replace_path(spark, new_path, path):
+    """
+    - Moves the folder written at new_path to path, with the folder already at path moved aside to a _replaced folder until the new one is in place and then deleted, so that a failure part way through does not lose the table
+    """
+    jvm_path = spark._jvm.org.apache.hadoop.fs.Path
+    fs = jvm_path(path).getFileSystem(spark._jsc.hadoopConfiguration())
+    old_path = path.rstrip("/") + "_replaced"
+    fs.delete(jvm_path(old_path), True)
+    if fs.exists(jvm_path(path)):
+        rename(fs, jvm_path(path), jvm_path(old_path))
+    rename(fs, jvm_path(new_path), jvm_path(path))
+    fs.delete(jvm_path(old_path), True)
+
+def write_table(spark, df, path, partition_cols=(), target_mb=128, dynamic=False, buckets=0, bucket_col=None, append=False):
+    """
+    - Write the dataframe to parquet files in files of about target_mb each
+    - The dataframe is persisted and counted first, which gives the row count, and its parquet size is measured by parquet_size_mb on a sample of the rows.  The write then reads the persisted rows rather than working them out again
+    - The rows are repartitioned by the partition columns into size / target_mb tasks, so the rows of a partition are written by a single task as one file, and partitions larger than target_mb are split into files of maxRecordsPerFile rows
+    - With buckets, each partition is instead split into that number of buckets by bucket_col, one file per bucket.  Bucketed files are written through the session catalog as a table named after the folder.  The table is written to a _writing folder next to path and swapped in by replace_path once it is complete, so a failed write leaves the old table as it was
+    - With dynamic, only the partitions the dataframe has rows for are replaced.  Bucketed partitions are replaced one folder at a time by replace_path
+    - With append, the rows are added to the files already at path
+    """
+    df.persist(StorageLevel.MEMORY_AND_DISK)
+    num_rows = df.count()
+    size_mb = parquet_size_mb(spark, df, num_rows, path)
+    num_files = max(1, math.ceil(size_mb / target_mb))
+    records_per_file = max(1, int(num_rows * target_mb / size_mb)) if size_mb else 0
+
+    if buckets:
+        df_layout = df.repartition(buckets, bucket_col)
+    elif partition_cols:
+        df_layout = df.repartition(num_files, *partition_cols)
+    else:
+        df_layout = df.repartition(num_files)
+
+    writer = df_layout.write.mode("append" if append else "overwrite").option("maxRecordsPerFile", records_per_file)
+    if dynamic:
+        writer = writer.option("partitionOverwriteMode", "dynamic")
+    if partition_cols:
+        writer = writer.partitionBy(*partition_cols)
+
+    if buckets:
+        table_name = path.rstrip("/").rsplit("/", 1)[-1].replace(".parquet", "")
+        new_path = path.rstrip("/") + "_writing"
+        delete_path(spark, new_path)
+        spark.sql("DROP TABLE IF EXISTS {}".format(table_name))
+        writer.bucketBy(buckets, bucket_col).sortBy(bucket_col).format("parquet").option("path", qualified_path(spark, new_path)).saveAsTable(table_name)
+        # the table is external, so dropping it leaves the files written, which are then moved to path
+        spark.sql("DROP TABLE {}".format(table_name))
+        if dynamic:
+            new_root = qualified_path(spark, new_path)
+            for partition_path in partition_files(spark, new_path):
+                replace_path(spark, partition_path, path.rstrip("/") + partition_path[len(new_root):])
+            delete_path(spark, new_path)
+        else:
+            replace_path(spark, new_path, path)
+    else:
+        writer.parquet(path)
+    df.unpersist()
+
+def partition_files(spark, path):
+    """
+    - Returns a dictionary of each folder under the table path that holds parquet files to a list of (file path, size in bytes) of those files
+    - Folders starting with _ or . such as _temporary are left out, as Spark does not read them
+    """
+    hadoop_path = spark._jvm.org.apache.hadoop.fs.Path(path)
+    files = hadoop_path.getFileSystem(spark._jsc.hadoopConfiguration()).listFiles(hadoop_path, True)
+    partitions = {}
+    while files.hasNext():
+        status = files.next()
+        file_path = status.getPath()
+        relative = file_path.toString()[len(hadoop_path.toString()):]
+        if not file_path.getName().endswith(".parquet") or any(part[:1] in ("_", ".") for part in relative.split("/")[:-1]):
+            continue
+        partitions.setdefault(file_path.getParent().toString(), []).append((file_path.toString(), status.getLen()))
+    return partitions
+
+def rename(fs, source, destination):
+    """
+    - Moves the Hadoop path source to destination, raising an IOError if the file system does not move it
+    """
+    if not fs.rename(source, destination):
+        raise IOError("could not move {} to {}".format(source.toString(), destination.toString()))
+
+def compact_partition(spark, partition_path, files, target_mb=128):
+    """
+    - Rewrites the parquet files of one partition folder in place as files of about target_mb each
+    - The new files are written to a _compacting folder inside the partition, which Spark does not read.  The old files are then moved aside to a _compacted folder, the new files moved into the partition and only then is _compacted deleted, so that a failure part way through leaves the old files in _compacted rather than losing them
+    - Returns the number of files written
+    """
+    num_files = max(1, math.ceil(sum(size for file_path, size in files) / 1024 / 1024 / target_mb))
+    temp_path = partition_path + "/_compacting"
+    old_path = partition_path + "/_compacted"
+    spark.read.parquet(*[file_path for file_path, size in files]).coalesce(num_files).write.mode("overwrite").parquet(temp_path)
+
+    jvm_path = spark._jvm.org.apache.hadoop.fs.Path
+    fs = jvm_path(partition_path).getFileSystem(spark._jsc.hadoopConfiguration())
+    new_files = [status.getPath() for status in fs.listStatus(jvm_path(temp_path)) if status.getPath().getName().endswith(".parquet")]
+    fs.mkdirs(jvm_path(old_path))
+    for file_path, size in files:
+        old_file = jvm_path(file_path)
+        rename(fs, old_file, jvm_path(old_path + "/" + old_file.getName()))
+    for new_file in new_files:
+        rename(fs, new_file, jvm_path(partition_path + "/" + new_file.getName()))
+    fs.delete(jvm_path(old_path), True)
+    fs.delete(jvm_path(temp_path), True)
+    return len(new_files)
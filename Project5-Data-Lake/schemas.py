@@ -0,0 +1,39 @@
+# schemas of the song and log data files, passed to the JSON readers so that Spark does not read every file to infer them
+from pyspark.sql.types import StructType, StructField, StringType, DoubleType, LongType
+
+# column that holds the text of records that do not match the schema when read in PERMISSIVE mode
+corrupt_record_column = "_corrupt_record"
+
+song_schema = StructType([
+    StructField("artist_id", StringType()),
+    StructField("artist_latitude", DoubleType()),
+    StructField("artist_location", StringType()),
+    StructField("artist_longitude", DoubleType()),
+    StructField("artist_name", StringType()),
+    StructField("duration", DoubleType()),
+    StructField("num_songs", LongType()),
+    StructField("song_id", StringType()),
+    StructField("title", StringType()),
+    StructField("year", LongType()),
+])
+
+log_schema = StructType([
+    StructField("artist", StringType()),
+    StructField("auth", StringType()),
+    StructField("firstName", StringType()),
+    StructField("gender", StringType()),
+    StructField("itemInSession", LongType()),
+    StructField("lastName", StringType()),
+    StructField("length", DoubleType()),
+    StructField("level", StringType()),
+    StructField("location", StringType()),
+    StructField("method", StringType()),
+    StructField("page", StringType()),
+    StructField("registration", DoubleType()),
+    StructField("sessionId", LongType()),
+    StructField("song", StringType()),
+    StructField("status", LongType()),
+    StructField("ts", LongType()),
+    StructField("userAgent", StringType()),
+    StructField("userId", StringType()),
+])
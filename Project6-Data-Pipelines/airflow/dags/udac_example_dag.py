@@ -33,11 +33,13 @@ stage_events_to_redshift = StageToRedshiftOperator(
     dag=dag,
     redshift_conn_id="redshift",
     aws_credentials_id="aws_credentials",
-    table="staging_events",
+    table="staging_events_raw",
     s3_bucket="udacity-dend",
     s3_key="log_data",
     file_format="json 's3://udacity-dend/log_json_path.json'",
-    region="us-west-2"
+    region="us-west-2",
+    columns=SqlQueries.staging_events_columns,
+    post_copy_sql=[SqlQueries.staging_events_truncate, SqlQueries.staging_events_key_insert]
 )
 
 stage_songs_to_redshift = StageToRedshiftOperator(
@@ -45,11 +47,13 @@ stage_songs_to_redshift = StageToRedshiftOperator(
     dag=dag,
     redshift_conn_id="redshift",
     aws_credentials_id="aws_credentials",
-    table="staging_songs",
+    table="staging_songs_raw",
     s3_bucket="udacity-dend",
     s3_key="song_data",
     file_format="json 'auto'",
-    region="us-west-2"
+    region="us-west-2",
+    columns=SqlQueries.staging_songs_columns,
+    post_copy_sql=[SqlQueries.staging_songs_truncate, SqlQueries.staging_songs_key_insert]
 )
 
 load_songplays_table = LoadFactOperator(
@@ -105,8 +109,10 @@ run_quality_checks = DataQualityOperator(
         "SELECT COUNT(*) FROM users WHERE userid IS NULL",\
         "SELECT COUNT(*) FROM songs WHERE songid IS NULL",\
         "SELECT COUNT(*) FROM artists WHERE artistid IS NULL",\
-        "SELECT COUNT(*) FROM time WHERE start_time IS NULL"],
-    result=[0,0,0,0,0]
+        "SELECT COUNT(*) FROM time WHERE start_time IS NULL",\
+        SqlQueries.songplay_join_old_only,\
+        SqlQueries.songplay_join_new_only],
+    result=[0,0,0,0,0,0,0]
 )
 
 end_operator = DummyOperator(task_id='Stop_execution',  dag=dag)
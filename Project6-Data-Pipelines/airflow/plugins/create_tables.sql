@@ -28,7 +28,7 @@ CREATE TABLE public.songs (
 	CONSTRAINT songs_pkey PRIMARY KEY (songid)
 );
 
-CREATE TABLE public.staging_events (
+CREATE TABLE public.staging_events_raw (
 	artist varchar(256),
 	auth varchar(256),
 	firstname varchar(256),
@@ -47,9 +47,34 @@ CREATE TABLE public.staging_events (
 	ts int8,
 	useragent varchar(256),
 	userid int4
-);
+)
+DISTSTYLE EVEN;
 
-CREATE TABLE public.staging_songs (
+CREATE TABLE public.staging_events (
+	artist varchar(256),
+	auth varchar(256),
+	firstname varchar(256),
+	gender varchar(256),
+	iteminsession int4,
+	lastname varchar(256),
+	length numeric(18,0),
+	"level" varchar(256),
+	location varchar(256),
+	"method" varchar(256),
+	page varchar(256),
+	registration numeric(18,0),
+	sessionid int4,
+	song varchar(256),
+	status int4,
+	ts int8,
+	useragent varchar(256),
+	userid int4,
+	song_key varchar(32)
+)
+DISTKEY(song_key)
+SORTKEY(song_key);
+
+CREATE TABLE public.staging_songs_raw (
 	num_songs int4,
 	artist_id varchar(256),
 	artist_name varchar(256),
@@ -60,7 +85,24 @@ CREATE TABLE public.staging_songs (
 	title varchar(256),
 	duration numeric(18,0),
 	"year" int4
-);
+)
+DISTSTYLE EVEN;
+
+CREATE TABLE public.staging_songs (
+	num_songs int4,
+	artist_id varchar(256),
+	artist_name varchar(256),
+	artist_latitude numeric(18,0),
+	artist_longitude numeric(18,0),
+	artist_location varchar(256),
+	song_id varchar(256),
+	title varchar(256),
+	duration numeric(18,0),
+	"year" int4,
+	song_key varchar(32)
+)
+DISTKEY(song_key)
+SORTKEY(song_key);
 
 CREATE TABLE public."time" (
 	start_time timestamp NOT NULL,
@@ -1,4 +1,32 @@
 class SqlQueries:
+    # staging_events and staging_songs are joined on a hash of the trimmed song title, the trimmed artist name and the song duration,
+    # so that songplays is built from a co-located single column join.  The files are copied into the unkeyed staging_events_raw and
+    # staging_songs_raw tables, which spreads the rows evenly over the slices, and then inserted into the staging tables distributed
+    # and sorted on song_key with the key computed in the select, so that the keyed tables are written sorted and spread by the key
+    song_key_expression = "MD5(TRIM({title}) || '|' || TRIM({artist}) || '|' || CAST(CAST({duration} AS DECIMAL(18,5)) AS VARCHAR))"
+
+    staging_events_columns = ("artist, auth, firstname, gender, iteminsession, lastname, length, level, location, method, page, "
+                              "registration, sessionid, song, status, ts, useragent, userid")
+
+    staging_songs_columns = ("num_songs, artist_id, artist_name, artist_latitude, artist_longitude, artist_location, song_id, "
+                             "title, duration, year")
+
+    staging_events_truncate = "TRUNCATE TABLE staging_events"
+
+    staging_songs_truncate = "TRUNCATE TABLE staging_songs"
+
+    staging_events_key_insert = ("""
+        INSERT INTO staging_events ({columns}, song_key)
+        SELECT {columns}, {song_key}
+        FROM staging_events_raw
+    """).format(columns=staging_events_columns, song_key=song_key_expression.format(title="song", artist="artist", duration="length"))
+
+    staging_songs_key_insert = ("""
+        INSERT INTO staging_songs ({columns}, song_key)
+        SELECT {columns}, {song_key}
+        FROM staging_songs_raw
+    """).format(columns=staging_songs_columns, song_key=song_key_expression.format(title="title", artist="artist_name", duration="duration"))
+
     songplay_table_insert = ("""
         SELECT
                 md5(events.sessionid || events.start_time) songplay_id,
@@ -14,9 +42,41 @@ class SqlQueries:
             FROM staging_events
             WHERE page='NextSong') events
             LEFT JOIN staging_songs songs
+            ON events.song_key = songs.song_key
+    """)
+
+    # number of event and song pairs matched only by the old join on title, artist and length, and only by the join on song_key,
+    # both should be 0
+    songplay_join_old_only = ("""
+        SELECT COUNT(*) FROM (
+            SELECT events.ts, events.userid, events.sessionid, events.iteminsession, songs.song_id
+            FROM staging_events events
+            JOIN staging_songs songs
+            ON events.song = songs.title
+                AND events.artist = songs.artist_name
+                AND events.length = songs.duration
+            EXCEPT
+            SELECT events.ts, events.userid, events.sessionid, events.iteminsession, songs.song_id
+            FROM staging_events events
+            JOIN staging_songs songs
+            ON events.song_key = songs.song_key
+        ) old_only
+    """)
+
+    songplay_join_new_only = ("""
+        SELECT COUNT(*) FROM (
+            SELECT events.ts, events.userid, events.sessionid, events.iteminsession, songs.song_id
+            FROM staging_events events
+            JOIN staging_songs songs
+            ON events.song_key = songs.song_key
+            EXCEPT
+            SELECT events.ts, events.userid, events.sessionid, events.iteminsession, songs.song_id
+            FROM staging_events events
+            JOIN staging_songs songs
             ON events.song = songs.title
                 AND events.artist = songs.artist_name
                 AND events.length = songs.duration
+        ) new_only
     """)
 
     user_table_insert = ("""
@@ -10,7 +10,7 @@ class StageToRedshiftOperator(BaseOperator):
     template_fields = ('s3_key',)
     
     copy_sql = """
-        COPY {}
+        COPY {} {}
         FROM '{}'
         ACCESS_KEY_ID '{}'
         SECRET_ACCESS_KEY '{}'
@@ -28,6 +28,8 @@ class StageToRedshiftOperator(BaseOperator):
                  s3_key="",
                  file_format="",
                  region="",
+                 columns="", # columns loaded from the files, needed when the table has columns that are set after the copy
+                 post_copy_sql="", # statement or list of statements run once the copy is complete, such as inserting the rows with their song join key into a keyed table
                  *args, **kwargs):
 
         super(StageToRedshiftOperator, self).__init__(*args, **kwargs)
@@ -38,6 +40,8 @@ class StageToRedshiftOperator(BaseOperator):
         self.s3_key = s3_key
         self.file_format = file_format
         self.region = region
+        self.columns = columns
+        self.post_copy_sql = post_copy_sql
 
     def execute(self, context):
         self.log.info("Get credentials")
@@ -53,6 +57,7 @@ class StageToRedshiftOperator(BaseOperator):
         s3_path = "s3://{}/{}".format(self.s3_bucket, rendered_key)
         formatted_sql = StageToRedshiftOperator.copy_sql.format(
             self.table,
+            "({})".format(self.columns) if self.columns else "",
             s3_path,
             credentials.access_key,
             credentials.secret_key,
@@ -60,4 +65,9 @@ class StageToRedshiftOperator(BaseOperator):
             self.region
         )
         redshift.run(formatted_sql)
-        self.log.info("Completed copy of data from s3 bucket to Redshift")
\ No newline at end of file
+        self.log.info("Completed copy of data from s3 bucket to Redshift")
+
+        if self.post_copy_sql:
+            self.log.info("Start post copy statements on {}".format(self.table))
+            redshift.run(self.post_copy_sql)
+            self.log.info("Completed post copy statements on {}".format(self.table))
\ No newline at end of file